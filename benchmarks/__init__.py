@@ -0,0 +1,13 @@
+import sys
+import timeit
+from typing import Callable
+
+
+def measure(name: str, func: Callable[[], object], number: int = 0) -> float:
+    timer = timeit.Timer(func)
+    if not number:
+        number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=5, number=number)) / number
+
+    print(f"{name:<48} {best * 1e6:>10.2f} us/op", file=sys.stdout)
+    return best
@@ -0,0 +1,13 @@
+import importlib
+import pathlib
+import sys
+
+selected = sys.argv[1:]
+
+for path in sorted(pathlib.Path(__file__).parent.glob("bench_*.py")):
+    if selected and path.stem not in selected:
+        continue
+
+    print(f"# {path.stem}")
+    importlib.import_module(f"benchmarks.{path.stem}").main()
+    print()
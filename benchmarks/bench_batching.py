@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from compress_asgi import CompressionBatcher, CompressionMiddleware
+
+RESPONSES = 10000
+BODY = b'{"id": 1, "name": "example", "tags": ["a", "b", "c"]}' * 12
+SCOPE = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+
+
+async def app(scope, receive, send):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BODY)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": BODY})
+
+
+async def receive():
+    return {"type": "http.request"}
+
+
+async def send(event):
+    pass
+
+
+async def run(middleware):
+    await asyncio.gather(
+        *(middleware(dict(SCOPE), receive, send) for _ in range(RESPONSES))
+    )
+
+
+def check(middleware):
+    """Fails unless the middleware actually compresses the benchmark response."""
+    sent = []
+
+    async def collect(event):
+        sent.append(event)
+
+    asyncio.run(middleware(dict(SCOPE), receive, collect))
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"], sent[0]
+
+
+def main():
+    variants = (
+        ("inline on the event loop", None),
+        ("executor call per response", CompressionBatcher(max_batch=1)),
+        ("batched executor calls", CompressionBatcher()),
+    )
+    for name, batcher in variants:
+        middleware = CompressionMiddleware(app, batcher=batcher)
+        check(middleware)
+
+        started = time.perf_counter()
+        asyncio.run(run(middleware))
+        elapsed = time.perf_counter() - started
+
+        print(f"{name:<48} {RESPONSES / elapsed:>10.0f} responses/s")
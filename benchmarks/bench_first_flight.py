@@ -0,0 +1,43 @@
+import random
+import zlib
+
+from compress_asgi.compressors import DeflateEncoder, GzipEncoder
+
+from . import measure
+
+FLIGHT = 16384
+WORDS = [f"word{index}" for index in range(400)]
+rng = random.Random(0)
+HEAD = b"<head>" + b"".join(
+    b'<link rel="preload" href="/static/%s.js">' % rng.choice(WORDS).encode()
+    for _ in range(300)
+)
+PAGE = HEAD + b"".join(
+    b"<p>%s</p>" % " ".join(rng.choice(WORDS) for _ in range(40)).encode()
+    for _ in range(2000)
+)
+CHUNKS = [PAGE[start : start + 4096] for start in range(0, len(PAGE), 4096)]
+
+
+def stream(encoder, flight):
+    engine = encoder("text/html", "best")
+    if flight:
+        engine.first_flight(FLIGHT, "fastest")
+    return [
+        engine.compress(chunk, index == len(CHUNKS) - 1)
+        for index, chunk in enumerate(CHUNKS)
+    ]
+
+
+def main():
+    for encoder, wbits in ((GzipEncoder, 31), (DeflateEncoder, 15)):
+        for flight in (False, True):
+            name = f"{encoder.__name__} best"
+            if flight:
+                name += f", {FLIGHT // 1024} KiB fastest flight"
+            measure(name, lambda: stream(encoder, flight), number=1)
+
+            outputs = stream(encoder, flight)
+            decoded = len(zlib.decompressobj(wbits).decompress(outputs[0]))
+            print(f"{'  bytes decodable after the first chunk':<48} {decoded:>10} B")
+            print(f"{'  bytes in total':<48} {sum(map(len, outputs)):>10} B")
@@ -0,0 +1,37 @@
+import os
+import random
+
+from compress_asgi import Fragment
+from compress_asgi.compressors import GzipEncoder
+from compress_asgi.fragments import stitch
+
+from . import measure
+
+WORDS = [os.urandom(4).hex() for _ in range(500)]
+
+
+def words(count: int) -> bytes:
+    return " ".join(random.Random(count).choice(WORDS) for _ in range(count)).encode()
+
+
+HEADER = Fragment(b"<html><head>" + words(4000) + b"</head><body><nav>", 6)
+FOOTER = Fragment(b"</main><footer>" + words(6000) + b"</footer></body></html>", 6)
+CORE = b"<main>" + words(300)
+PAGE = HEADER.data + CORE + FOOTER.data
+
+
+def main():
+    whole = measure(
+        f"GzipEncoder level 6, whole {len(PAGE) // 1024} KiB page",
+        lambda: GzipEncoder("text/html", 6).compress(PAGE, True),
+    )
+    stitched = measure(
+        f"stitched, {len(CORE) // 1024} KiB dynamic core",
+        lambda: stitch(GzipEncoder("text/html", 6), (HEADER, CORE, FOOTER)),
+    )
+    print(f"{'speed-up':<48} {whole / stitched:>10.2f} x")
+    print(
+        f"{'size, whole / stitched':<48} "
+        f"{len(GzipEncoder('text/html', 6).compress(PAGE, True)):>10} / "
+        f"{len(stitch(GzipEncoder('text/html', 6), (HEADER, CORE, FOOTER)))} B"
+    )
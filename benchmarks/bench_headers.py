@@ -0,0 +1,39 @@
+from compress_asgi.headers_tools import ResponseHeaders
+
+from . import measure
+
+try:
+    from starlette.datastructures import MutableHeaders
+except ModuleNotFoundError:
+    MutableHeaders = None
+
+RAW_HEADERS = [
+    (b"content-type", b"application/json; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-request-id", b"8d3c0a6e-5c3f-4b3e-9f84-8ad3a2f0c1b7"),
+    (b"set-cookie", b"session=abcdef; HttpOnly; Path=/"),
+    (b"vary", b"origin"),
+    (b"content-length", b"18243"),
+]
+
+
+def starlette_response_init():
+    headers = MutableHeaders(raw=list(RAW_HEADERS))
+    int(headers.get("content-length", 0))
+    headers.get("content-type", "").partition(";")[0].strip()
+    headers["content-encoding"] = "gzip"
+    headers.add_vary_header("accept-encoding")
+    headers["content-length"] = "4310"
+
+
+def single_pass_response_init():
+    headers = ResponseHeaders(RAW_HEADERS)
+    headers.content_length
+    headers.mimetype
+    headers.rebuild("gzip", 4310)
+
+
+def main():
+    if MutableHeaders:
+        measure("starlette MutableHeaders lookups + setitem", starlette_response_init)
+    measure("ResponseHeaders single pass + rebuild", single_pass_response_init)
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+
+
+def import_time(module: str) -> int:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    # the last line reports the cumulative time of the requested module
+    *_, last_line = result.stderr.strip().splitlines()
+    return int(last_line.split("|")[1])
+
+
+def main():
+    for module in ("compress_asgi", "compress_asgi.batching"):
+        best = min(import_time(module) for _ in range(5))
+        print(f"{'import ' + module:<48} {best / 1000:>10.2f} ms")
@@ -0,0 +1,41 @@
+import tracemalloc
+
+from compress_asgi.compressors import GzipEncoder
+from compress_asgi.jsonstream import JSONSlices, json_dumps
+
+from . import measure
+
+ITEMS = [
+    {"id": index, "name": f"item {index}", "score": index * 0.5, "tags": ["a", "b"]}
+    for index in range(50000)
+]
+
+
+def whole():
+    return GzipEncoder("application/json", 6).compress(json_dumps(ITEMS), True)
+
+
+def fused():
+    engine = GzipEncoder("application/json", 6)
+    slices = JSONSlices(ITEMS, json_dumps, 65536)
+    compressed_size = 0
+    while not slices.done:
+        compressed_size += len(engine.compress(slices.next_slice(), slices.done))
+    return compressed_size
+
+
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    measure(f"serialize then compress, {len(ITEMS)} items", whole, 3)
+    measure("fused 64 KiB slices", fused, 3)
+    print(
+        f"{'peak memory, whole / fused':<48} "
+        f"{peak_memory(whole) // 1024:>10} / {peak_memory(fused) // 1024} KiB"
+    )
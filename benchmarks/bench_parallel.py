@@ -0,0 +1,31 @@
+import asyncio
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from compress_asgi import ParallelCompressor
+from compress_asgi.compressors import GzipEncoder
+
+from . import measure
+
+WORDS = [os.urandom(4).hex() for _ in range(2000)]
+BODY = " ".join(random.Random(0).choice(WORDS) for _ in range(4_000_000)).encode()
+
+
+def main():
+    size = len(BODY) / 2**20
+    executor = ThreadPoolExecutor(os.cpu_count())
+    parallel = ParallelCompressor(executor=executor)
+
+    single = measure(
+        f"GzipEncoder level 6, {size:.0f} MiB",
+        lambda: GzipEncoder("text/plain", 6).compress(BODY, True),
+        number=1,
+    )
+    blocks = measure(
+        f"ParallelCompressor level 6, {os.cpu_count()} threads",
+        lambda: asyncio.run(parallel.compress(GzipEncoder("text/plain", 6), BODY)),
+        number=1,
+    )
+    print(f"{'speed-up':<48} {single / blocks:>10.2f} x")
+    executor.shutdown()
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import tempfile
+
+from compress_asgi import MmapStore
+from compress_asgi.compressors import BrotliEncoder, GzipEncoder
+
+from . import measure
+
+BODY = b'{"id": 1, "name": "example", "tags": ["a", "b", "c"]}' * 2000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        store = MmapStore(os.path.join(directory, "store"))
+        asyncio.run(
+            store.put(b"key", GzipEncoder("application/json").compress(BODY, True))
+        )
+
+        size = len(BODY) // 1024
+        measure(
+            f"GzipEncoder level 9, {size} KiB",
+            lambda: GzipEncoder("application/json").compress(BODY, True),
+        )
+        if BrotliEncoder.available():
+            measure(
+                f"BrotliEncoder level 11, {size} KiB",
+                lambda: BrotliEncoder("application/json").compress(BODY, True),
+            )
+        loop = asyncio.new_event_loop()
+        measure("MmapStore hit", lambda: loop.run_until_complete(store.get(b"key")))
+
+        loop.close()
+        store.close()
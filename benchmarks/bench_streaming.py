@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tracemalloc
+
+from compress_asgi import CompressionMiddleware
+
+BODY = os.urandom(1 << 20) * 32
+
+
+async def app(scope, receive, send):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": BODY, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def run(middleware):
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(event):
+        pass
+
+    await middleware(scope, receive, send)
+
+
+def main():
+    for slice_size in (0, 65536):
+        tracemalloc.start()
+        asyncio.run(run(CompressionMiddleware(app, stream_slice_size=slice_size)))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        name = f"stream_slice_size={slice_size}"
+        print(f"{name:<48} {peak / 2**20:>10.2f} MiB peak")
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from compress_asgi import CompressionLimiter, CompressionMiddleware
+
+RESPONSES = 2000
+THREADS = (1, 2, 4, 8)
+BODY = b'{"id": 1, "name": "example", "tags": ["a", "b", "c"]}' * 400
+SCOPE = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+
+
+async def app(scope, receive, send):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BODY)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": BODY})
+
+
+async def receive():
+    return {"type": "http.request"}
+
+
+async def send(event):
+    pass
+
+
+async def run(middleware):
+    for _ in range(RESPONSES):
+        await middleware(dict(SCOPE), receive, send)
+
+
+def main():
+    # one middleware and limiter shared by every thread, each with its own loop
+    middleware = CompressionMiddleware(
+        app, limiter=CompressionLimiter(max_streams=1024)
+    )
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    print(f"GIL {'enabled' if gil else 'disabled'}, {cores} usable cores")
+    if gil or cores < 2:
+        print("throughput cannot scale here: needs free-threading and several cores")
+
+    baseline = None
+    for count in THREADS:
+        threads = [
+            threading.Thread(target=asyncio.run, args=(run(middleware),))
+            for _ in range(count)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throughput = count * RESPONSES / (time.perf_counter() - started)
+
+        baseline = baseline or throughput
+        print(
+            f"{count:>2} threads{'':<38} {throughput:>10.0f} responses/s"
+            f" {throughput / baseline:>6.2f}x"
+        )
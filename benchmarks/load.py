@@ -0,0 +1,255 @@
+"""
+End-to-end load benchmark of CompressionMiddleware against Starlette's
+GZipMiddleware and brotli-asgi, served by uvicorn on the loopback interface.
+
+    python -m benchmarks.load [--duration 5] [--concurrency 32] [--clients 1]
+
+Requires uvicorn and httpx; middlewares which are not installed are skipped.
+Server CPU time is read from /proc, so CPU figures are Linux only.
+
+A single client process tops out well before a multi-core server does, since
+httpx parses every response on one event loop; `--clients N` spreads the
+connections over N processes and aggregates their measurements.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import time
+
+import httpx
+
+MIDDLEWARES = ("none", "compress_asgi", "starlette_gzip", "brotli_asgi")
+ACCEPT_ENCODING = "gzip, deflate, br"
+SSE_EVENTS = 50
+
+
+def build_corpora():
+    rng = random.Random(0)
+    words = [
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))
+        )
+        for _ in range(500)
+    ]
+
+    def sentence(length):
+        return " ".join(rng.choice(words) for _ in range(length))
+
+    api = json.dumps(
+        [
+            {
+                "id": index,
+                "name": sentence(3),
+                "email": f"{rng.choice(words)}@example.com",
+                "active": rng.random() > 0.5,
+                "score": round(rng.random() * 100, 3),
+                "tags": [rng.choice(words) for _ in range(4)],
+            }
+            for index in range(200)
+        ]
+    ).encode()
+    html = (
+        "<!doctype html><html><head><title>Benchmark</title></head><body>"
+        + "".join(
+            f'<div class="card"><h2>{sentence(4)}</h2><p>{sentence(60)}</p>'
+            f'<a href="/{rng.choice(words)}">{sentence(2)}</a></div>'
+            for _ in range(80)
+        )
+        + "</body></html>"
+    ).encode()
+    bundle = "".join(
+        f"function {rng.choice(words)}_{index}(a, b) {{ "
+        f"const {rng.choice(words)} = a.map((x) => x * {index}); "
+        f'return b.filter(Boolean).join("{rng.choice(words)}"); }}\n'
+        for index in range(1500)
+    ).encode()
+    events = [
+        b"event: update\ndata: %s\n\n"
+        % json.dumps({"seq": index, "text": sentence(12)}).encode()
+        for index in range(SSE_EVENTS)
+    ]
+
+    return {
+        "/api": ("application/json", api),
+        "/page": ("text/html; charset=utf-8", html),
+        "/bundle.js": ("text/javascript", bundle),
+        "/events": ("text/event-stream", events),
+    }
+
+
+def build_app(middleware: str):
+    corpora = build_corpora()
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        content_type, body = corpora[scope["path"]]
+        headers = [(b"content-type", content_type.encode())]
+        chunks = body if isinstance(body, list) else [body]
+        if not isinstance(body, list):
+            headers.append((b"content-length", str(len(body)).encode()))
+
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for index, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": index < len(chunks) - 1,
+                }
+            )
+
+    if middleware == "compress_asgi":
+        from compress_asgi import CompressionMiddleware
+
+        # event streams are only compressed when opted in
+        return CompressionMiddleware(app, streaming_mediatype=("text/event-stream",))
+    if middleware == "starlette_gzip":
+        from starlette.middleware.gzip import GZipMiddleware
+
+        return GZipMiddleware(app)
+    if middleware == "brotli_asgi":
+        from brotli_asgi import BrotliMiddleware
+
+        return BrotliMiddleware(app)
+    return app
+
+
+def available(middleware: str) -> bool:
+    if middleware == "none":
+        return True
+
+    module = {"starlette_gzip": "starlette"}.get(middleware, middleware)
+    try:
+        __import__(module)
+    except ModuleNotFoundError:
+        return False
+    return True
+
+
+def serve(middleware: str, port: int) -> None:
+    import uvicorn
+
+    uvicorn.run(build_app(middleware), host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(url: str) -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                await client.get(url + "/api")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+async def generate_load(url: str, path: str, duration: float, concurrency: int):
+    latencies = []
+    wire_bytes = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        nonlocal wire_bytes
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            async with client.stream("GET", url + path) as response:
+                async for chunk in response.aiter_raw():
+                    wire_bytes += len(chunk)
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        headers={"accept-encoding": ACCEPT_ENCODING}, limits=limits
+    ) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    return latencies, wire_bytes
+
+
+def client_process(url: str, path: str, duration: float, concurrency: int):
+    return asyncio.run(generate_load(url, path, duration, concurrency))
+
+
+def process_cpu(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rpartition(")")[2].split()
+    # utime and stime are the 14th and 15th fields of the whole line
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run_scenario(
+    middleware: str, path: str, duration: float, concurrency: int, clients: int
+):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=serve, args=(middleware, port))
+
+    server.start()
+    try:
+        asyncio.run(wait_until_ready(url))
+        shares = [
+            concurrency // clients + (index < concurrency % clients)
+            for index in range(clients)
+        ]
+        with multiprocessing.Pool(clients) as pool:
+            cpu_before = process_cpu(server.pid)
+            results = pool.starmap(
+                client_process, [(url, path, duration, share) for share in shares]
+            )
+            cpu = process_cpu(server.pid) - cpu_before
+    finally:
+        server.terminate()
+        server.join()
+
+    latencies = [latency for result, _ in results for latency in result]
+    wire_bytes = sum(wire_bytes for _, wire_bytes in results)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests/s": len(latencies) / duration,
+        "p50 ms": percentiles[49] * 1000,
+        "p99 ms": percentiles[98] * 1000,
+        "cpu us/req": cpu / len(latencies) * 1e6,
+        "bytes/req": wire_bytes / len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--middleware", nargs="*", default=MIDDLEWARES)
+    args = parser.parse_args()
+
+    columns = ("requests/s", "p50 ms", "p99 ms", "cpu us/req", "bytes/req")
+    print(f"{'corpus':<12}{'middleware':<16}" + "".join(f"{c:>14}" for c in columns))
+
+    for path in build_corpora():
+        for middleware in args.middleware:
+            if not available(middleware):
+                continue
+            result = run_scenario(
+                middleware, path, args.duration, args.concurrency, args.clients
+            )
+            print(
+                f"{path:<12}{middleware:<16}"
+                + "".join(f"{result[c]:>14.1f}" for c in columns)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Replays traffic recorded by TrafficRecorder through CompressionMiddleware,
+once per middleware configuration, and compares CPU time and output size.
+
+    python -m benchmarks.replay traffic.jsonl [--config '{"minimum_size": 1000}']
+
+Every --config is a JSON object of CompressionMiddleware keyword arguments;
+the default configuration always runs first. Redacted bodies are replayed as
+recorded; other bodies are synthesized to the recorded zlib level 1 ratio.
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import random
+import time
+import zlib
+
+from compress_asgi import CompressionMiddleware
+
+BLOCK_SIZE = 512
+
+
+def text_block(rng: random.Random, words) -> bytes:
+    text = " ".join(rng.choice(words) for _ in range(BLOCK_SIZE // 4)).encode()
+    return text[:BLOCK_SIZE]
+
+
+def synthesize(size: int, ratio: float, rng: random.Random) -> bytes:
+    """
+    `size` bytes compressing to about `ratio` at zlib level 1: text blocks
+    mixed with repeats of earlier blocks below the ratio of text alone, with
+    random blocks above it.
+    """
+    words = ["".join(rng.choice("etaoinshrdlu") for _ in range(5)) for _ in range(64)]
+    text = b"".join(text_block(rng, words) for _ in range(64))
+    text_ratio = len(zlib.compress(text, 1)) / len(text)
+    if ratio < text_ratio:
+        repeat_share, random_share = 1 - ratio / text_ratio, 0.0
+    else:
+        repeat_share, random_share = 0.0, (ratio - text_ratio) / (1 - text_ratio)
+
+    blocks = [text_block(rng, words)]
+    for _ in range(BLOCK_SIZE, size, BLOCK_SIZE):
+        draw = rng.random()
+        if draw < repeat_share:
+            blocks.append(rng.choice(blocks[-16:]))
+        elif draw < repeat_share + random_share:
+            blocks.append(rng.randbytes(BLOCK_SIZE))
+        else:
+            blocks.append(text_block(rng, words))
+    return b"".join(blocks)[:size]
+
+
+def load(path: str):
+    rng = random.Random(0)
+    responses = []
+
+    with open(path) as records:
+        for line in records:
+            record = json.loads(line)
+            size = sum(record["chunks"])
+            if "body" in record:
+                body = base64.b64decode(record["body"])
+            else:
+                body = synthesize(size, record["ratio"], rng)
+
+            chunks, offset = [], 0
+            for chunk_size in record["chunks"]:
+                chunks.append(body[offset : offset + chunk_size])
+                offset += chunk_size
+
+            headers = [(b"content-type", record["content_type"].encode("latin-1"))]
+            if record["content_length"] is not None:
+                headers.append((b"content-length", str(size).encode()))
+            responses.append((record, headers, chunks))
+
+    return responses
+
+
+def build_app(headers, chunks, status):
+    async def app(scope, receive, send):
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        for index, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": index < len(chunks) - 1,
+                }
+            )
+
+    return app
+
+
+async def replay(responses, options):
+    totals = collections.Counter()
+    encodings = collections.Counter()
+
+    async def receive():
+        return {"type": "http.request"}
+
+    for record, headers, chunks in responses:
+        scope = {
+            "type": "http",
+            "path": record.get("path", "/"),
+            "headers": [(b"accept-encoding", record["accept_encoding"].encode())],
+        }
+        encoding = "identity"
+
+        async def send(event):
+            nonlocal encoding
+            if event["type"] == "http.response.start":
+                encoding = dict(event["headers"]).get(b"content-encoding", b"identity")
+            else:
+                totals["bytes out"] += len(event.get("body", b""))
+
+        middleware = CompressionMiddleware(
+            build_app(headers, chunks, record["status"]), **options
+        )
+        await middleware(scope, receive, send)
+
+        totals["bytes in"] += sum(map(len, chunks))
+        encodings[encoding.decode() if isinstance(encoding, bytes) else encoding] += 1
+
+    return totals, encodings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--config", action="append", default=[])
+    args = parser.parse_args()
+
+    responses = load(args.path)
+    print(f"{len(responses)} responses")
+
+    for config in ("{}", *args.config):
+        options = json.loads(config)
+        started = time.process_time()
+        totals, encodings = asyncio.run(replay(responses, options))
+        cpu = time.process_time() - started
+
+        print(f"# {config}")
+        print(f"{'cpu us/response':<32} {cpu / len(responses) * 1e6:>12.1f}")
+        print(f"{'bytes in':<32} {totals['bytes in']:>12}")
+        print(f"{'bytes out':<32} {totals['bytes out']:>12}")
+        print(f"{'ratio':<32} {totals['bytes out'] / totals['bytes in']:>12.3f}")
+        for encoding, count in encodings.most_common():
+            print(f"{'responses ' + encoding:<32} {count:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,42 @@
+import importlib
+
+from .fragments import Fragment, fragments_body
+from .jsonstream import JSONStreamer, send_json_items
 from .middleware import CompressionMiddleware
 
-__all__ = (CompressionMiddleware,)
+__all__ = (
+    "ClientRule",
+    "CompressibilityTracker",
+    "CompressionBatcher",
+    "CompressionLimiter",
+    "CompressionMiddleware",
+    "Fragment",
+    "JSONStreamer",
+    "MmapStore",
+    "NetworkHints",
+    "ParallelCompressor",
+    "RedisStore",
+    "TrafficRecorder",
+    "fragments_body",
+    "send_json_items",
+)
+
+# imported on first access, keeping asyncio and ipaddress out of the import path
+LAZY_EXPORTS = {
+    "ClientRule": "clients",
+    "CompressibilityTracker": "learning",
+    "CompressionBatcher": "batching",
+    "CompressionLimiter": "limiter",
+    "MmapStore": "store",
+    "NetworkHints": "hints",
+    "ParallelCompressor": "parallel",
+    "RedisStore": "store",
+    "TrafficRecorder": "recording",
+}
+
+
+def __getattr__(name: str):
+    if name in LAZY_EXPORTS:
+        module = importlib.import_module(f".{LAZY_EXPORTS[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
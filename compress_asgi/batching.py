@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from concurrent.futures import Executor
+from typing import List, Optional, Sequence, Tuple
+
+from .compressors import BaseEncoder
+
+
+def compress_batch(jobs: Sequence[Tuple[BaseEncoder, bytes]]) -> List[bytes]:
+    return [engine.compress(data, True) for engine, data in jobs]
+
+
+class CompressionBatcher:
+    """
+    Collects single-body responses finishing within `window` seconds and
+    compresses them together in one executor call, amortizing the thread
+    handoff over up to `max_batch` responses. Requires an asyncio event loop.
+
+    Pending responses are queued per thread, so servers running one event loop
+    per thread never share a batch across loops.
+    """
+
+    def __init__(
+        self,
+        window: float = 0.0005,
+        max_batch: int = 64,
+        max_body_size: int = 16384,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.window = window
+        self.max_batch = max_batch
+        self.max_body_size = max_body_size
+        self.executor = executor
+
+        self.local = threading.local()
+
+    @property
+    def pending(self) -> List[Tuple[BaseEncoder, bytes, asyncio.Future]]:
+        try:
+            return self.local.pending
+        except AttributeError:
+            self.local.pending = []
+            self.local.flush_handle = None
+            return self.local.pending
+
+    def accepts(self, engine: BaseEncoder, data: bytes) -> bool:
+        return bool(engine.encoding_name) and len(data) <= self.max_body_size
+
+    async def compress(self, engine: BaseEncoder, data: bytes) -> bytes:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.pending
+        pending.append((engine, data, future))
+
+        if len(pending) >= self.max_batch:
+            self.flush()
+        elif self.local.flush_handle is None:
+            self.local.flush_handle = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        batch = self.pending
+        if self.local.flush_handle is not None:
+            self.local.flush_handle.cancel()
+            self.local.flush_handle = None
+
+        self.local.pending = []
+        futures = [future for _, _, future in batch]
+
+        def distribute(task: asyncio.Future) -> None:
+            error = task.exception()
+            results = [None] * len(futures) if error else task.result()
+
+            for future, compressed_data in zip(futures, results):
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(compressed_data)
+
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            compress_batch,
+            [(engine, data) for engine, data, _ in batch],
+        )
+        task.add_done_callback(distribute)
@@ -0,0 +1,86 @@
+import functools
+import ipaddress
+import re
+from typing import Collection, Optional, TypeVar, Union
+
+from .compressors import Level
+
+try:
+    from asgiref.typing import Scope
+except ModuleNotFoundError:
+    Scope = TypeVar("Scope")
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_address(
+    host: str,
+) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    try:
+        return ipaddress.ip_address(host)
+    except ValueError:
+        return None
+
+
+class ClientRule:
+    """
+    Overrides compression for matching clients: `override` is False to send
+    identity or a level such as "fastest". A rule matches when every given
+    criterion does: the client address within one of `networks`, the
+    `User-Agent` matching the `user_agent` pattern, or the `header` present
+    (and equal to `header_value` if given). At least one criterion is
+    required.
+    """
+
+    def __init__(
+        self,
+        override: Union[Level, bool] = False,
+        networks: Collection[str] = (),
+        user_agent: Optional[str] = None,
+        header: Optional[str] = None,
+        header_value: Optional[str] = None,
+    ) -> None:
+        if not (networks or user_agent or header):
+            raise ValueError("ClientRule needs networks, user_agent or header")
+
+        self.override = override
+        self.networks = tuple(ipaddress.ip_network(network) for network in networks)
+        self.user_agent = re.compile(user_agent) if user_agent else None
+        self.header = header.lower().encode("latin-1") if header else None
+        self.header_value = (
+            header_value.encode("latin-1") if header_value is not None else None
+        )
+
+    def matches_client(self, scope: Scope) -> bool:
+        client = scope.get("client")
+        address = parse_address(client[0]) if client else None
+        return address is not None and any(
+            address in network for network in self.networks
+        )
+
+    def matches_headers(self, scope: Scope) -> bool:
+        user_agent = None
+        header_value = None
+        for key, value in scope.get("headers", ()):
+            if key == b"user-agent":
+                user_agent = value
+            elif key == self.header:
+                header_value = value
+
+        if self.user_agent and (
+            user_agent is None
+            or not self.user_agent.search(user_agent.decode("latin-1"))
+        ):
+            return False
+        if self.header and (
+            header_value is None
+            or (self.header_value is not None and header_value != self.header_value)
+        ):
+            return False
+        return True
+
+    def matches(self, scope: Scope) -> bool:
+        if self.networks and not self.matches_client(scope):
+            return False
+        if (self.user_agent or self.header) and not self.matches_headers(scope):
+            return False
+        return True
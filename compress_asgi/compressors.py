@@ -1,9 +1,29 @@
-import gzip
 import io
+import struct
 import zlib
-from typing import Collection, TypeVar
-
-from .headers_tools import Headers, MutableHeaders
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Collection,
+    Dict,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+from .deflate_tools import WINDOW_SIZE
+from .headers_tools import Headers, ResponseHeaders, parse_byte_range
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .hints import NetworkHints
+    from .instrumentation import EncoderStats
+    from .learning import CompressibilityTracker
+    from .limiter import CompressionLimiter
 
 try:
     from asgiref.typing import (
@@ -16,60 +36,154 @@ except ModuleNotFoundError:
     HTTPResponseStartEvent = TypeVar("HTTPResponseStartEvent")
     Scope = TypeVar("Scope")
 
-try:
-    import brotli
-except ModuleNotFoundError:
-    brotli = None
+OVERRIDE_STATE_KEY = "compression"
+
+Level = Union[int, str, None]
+
+# (largest content-length, encoding name, level); None stands for no limit
+Tier = Tuple[Optional[int], str, Level]
+
+BACKENDS: Dict[str, Optional[ModuleType]] = {}
+
+
+def load_backend(name: str) -> Optional[ModuleType]:
+    """Imports an encoder backend on first use, None when it is not installed."""
+    if name not in BACKENDS:
+        try:
+            BACKENDS[name] = __import__(name)
+        except ModuleNotFoundError:
+            BACKENDS[name] = None
+
+    return BACKENDS[name]
+
+
+def check_level(level: Union[Level, bool], identity: bool = True) -> None:
+    """
+    Rejects level settings no encoder resolves, when the middleware is
+    configured rather than per request. False (identity) only where allowed.
+    """
+    if level is False and identity:
+        return
+    if level is None or level in ("fastest", "best"):
+        return
+    if not isinstance(level, int) or isinstance(level, bool):
+        raise ValueError(f"invalid compression level: {level!r}")
 
 
 class BaseEncoder:
     encoding_name: str = ""
+    backend: str = ""
+    levels: range = range(1)
+    default_level: int = 0
 
-    def __init__(self, response_mimetype: str) -> None:
+    def __init__(self, response_mimetype: str, level: Level = None) -> None:
         self.content_length = 0
+        self.mimetype = response_mimetype
+        self.level = self.resolve_level(level)
+        self.flight_remaining = 0
+
+    @classmethod
+    def available(cls) -> bool:
+        return not cls.backend or load_backend(cls.backend) is not None
+
+    @classmethod
+    def resolve_level(cls, level: Level) -> int:
+        if level == "fastest":
+            return cls.levels[0]
+        if level == "best":
+            return cls.levels[-1]
+        if isinstance(level, int) and not isinstance(level, bool):
+            return min(max(level, cls.levels[0]), cls.levels[-1])
+        return cls.default_level
+
+    def first_flight(self, size: int, level: Level) -> None:
+        """
+        Compresses the first `size` bytes of the stream at `level`, flushing
+        after every chunk, and the rest at the encoder's own level. Encoders
+        which cannot change level mid-stream only flush.
+        """
+        self.flight_remaining = size
 
     def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
         self.content_length += len(data)
         return data
 
+    async def compress_stream(
+        self, data: bytes, last_chunk: bool = False, slice_size: int = 65536
+    ) -> AsyncIterator[bytes]:
+        """
+        Compresses `data` in slices of at most `slice_size` bytes, yielding the
+        output of every slice, so the consumer can await between them.
+        """
+        for start in range(0, max(len(data), 1), slice_size):
+            end = start + slice_size
+            compressed_data = self.compress(
+                data[start:end], last_chunk and end >= len(data)
+            )
+            if compressed_data:
+                yield compressed_data
 
-if brotli:
 
-    class BrotliEncoder(BaseEncoder):
-        encoding_name: str = "br"
+class BrotliEncoder(BaseEncoder):
+    encoding_name: str = "br"
+    backend: str = "brotli"
+    levels: range = range(0, 12)
+    default_level: int = 11
 
-        def __init__(self, response_mimetype: str) -> None:
-            super().__init__(response_mimetype)
+    def __init__(self, response_mimetype: str, level: Level = None) -> None:
+        super().__init__(response_mimetype, level)
+        brotli = load_backend(self.backend)
 
-            if any(
-                predicate in response_mimetype
-                for predicate in ("text", "javascript", "json", "xml")
-            ):
-                mode = brotli.MODE_TEXT
-            elif "font" in response_mimetype:
-                mode = brotli.MODE_FONT
-            else:
-                mode = brotli.MODE_GENERIC
+        if any(
+            predicate in response_mimetype
+            for predicate in ("text", "javascript", "json", "xml")
+        ):
+            mode = brotli.MODE_TEXT
+        elif "font" in response_mimetype:
+            mode = brotli.MODE_FONT
+        else:
+            mode = brotli.MODE_GENERIC
 
-            self.compressor = brotli.Compressor(mode=mode)
+        self.compressor = brotli.Compressor(mode=mode, quality=self.level)
 
-        def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
-            compressed_data = self.compressor.process(data) + (
-                self.compressor.finish() if last_chunk else b""
-            )
+    def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
+        compressed_data = self.compressor.process(data)
+        if last_chunk:
+            compressed_data += self.compressor.finish()
+        elif self.flight_remaining:
+            self.flight_remaining = max(self.flight_remaining - len(data), 0)
+            compressed_data += self.compressor.flush()
 
-            return super().compress(compressed_data, last_chunk)
+        return super().compress(compressed_data, last_chunk)
 
 
 class GzipEncoder(BaseEncoder):
     encoding_name: str = "gzip"
+    backend: str = "gzip"
+    levels: range = range(1, 10)
+    default_level: int = 9
 
-    def __init__(self, response_mimetype: str) -> None:
-        super().__init__(response_mimetype)
+    def __init__(self, response_mimetype: str, level: Level = None) -> None:
+        super().__init__(response_mimetype, level)
         self.buffer = io.BytesIO()
-        self.file = gzip.GzipFile(mode="wb", fileobj=self.buffer)
+        # created on first use, as a first flight compresses without it
+        self.file: Optional[io.BufferedIOBase] = None
+        self.phases: Optional[PhasedDeflate] = None
+
+    def first_flight(self, size: int, level: Level) -> None:
+        self.phases = PhasedDeflate(31, self.level, size, self.resolve_level(level))
 
     def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
+        if self.phases is not None:
+            compressed_data = self.phases.compress(data)
+            if last_chunk:
+                compressed_data += self.phases.flush()
+            return super().compress(compressed_data, last_chunk)
+
+        if self.file is None:
+            self.file = load_backend(self.backend).GzipFile(
+                mode="wb", fileobj=self.buffer, compresslevel=self.level
+            )
         self.file.write(data)
         if last_chunk:
             self.file.close()
@@ -83,10 +197,18 @@ class GzipEncoder(BaseEncoder):
 
 class DeflateEncoder(BaseEncoder):
     encoding_name: str = "deflate"
+    backend: str = "zlib"
+    levels: range = range(1, 10)
+    default_level: int = 6
 
-    def __init__(self, response_mimetype: str) -> None:
-        super().__init__(response_mimetype)
-        self.compressobj = zlib.compressobj(method=zlib.DEFLATED)
+    def __init__(self, response_mimetype: str, level: Level = None) -> None:
+        super().__init__(response_mimetype, level)
+        self.compressobj = zlib.compressobj(level=self.level, method=zlib.DEFLATED)
+
+    def first_flight(self, size: int, level: Level) -> None:
+        self.compressobj = PhasedDeflate(
+            15, self.level, size, self.resolve_level(level)
+        )
 
     def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
         compressed_data = self.compressobj.compress(data)
@@ -96,62 +218,522 @@ class DeflateEncoder(BaseEncoder):
         return super().compress(compressed_data, last_chunk)
 
 
+class ZstdEncoder(BaseEncoder):
+    encoding_name: str = "zstd"
+    backend: str = "zstandard"
+    levels: range = range(1, 23)
+    default_level: int = 3
+
+    def __init__(self, response_mimetype: str, level: Level = None) -> None:
+        super().__init__(response_mimetype, level)
+        self.zstandard = load_backend(self.backend)
+        self.compressobj = self.zstandard.ZstdCompressor(level=self.level).compressobj()
+        self.main_compressobj = self.compressobj
+
+    def first_flight(self, size: int, level: Level) -> None:
+        """
+        Sends the first flight as a zstd frame of its own, followed by a frame
+        holding the rest, as zstd cannot change the level within a frame.
+        RFC 8878 decoders read concatenated frames as one body, but one-shot
+        decoders which stop after the first frame only see the first flight.
+        """
+        super().first_flight(size, level)
+        self.compressobj = self.zstandard.ZstdCompressor(
+            level=self.resolve_level(level)
+        ).compressobj()
+
+    def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
+        compressed_data = b""
+        if self.flight_remaining:
+            flight, data = split_flight(self, data)
+            finished = last_chunk or not self.flight_remaining
+            compressed_data = self.compressobj.compress(
+                flight
+            ) + self.compressobj.flush(
+                self.zstandard.COMPRESSOBJ_FLUSH_FINISH
+                if finished
+                else self.zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+            if not finished or (last_chunk and not data):
+                return super().compress(compressed_data, last_chunk)
+
+            self.compressobj = self.main_compressobj
+
+        compressed_data += self.compressobj.compress(data)
+        if last_chunk:
+            compressed_data += self.compressobj.flush(
+                self.zstandard.COMPRESSOBJ_FLUSH_FINISH
+            )
+
+        return super().compress(compressed_data, last_chunk)
+
+
+def split_flight(owner, data: bytes) -> Tuple[bytes, bytes]:
+    """Splits `data` at the end of the first flight of `owner`."""
+    flight, rest = data[: owner.flight_remaining], data[owner.flight_remaining :]
+    owner.flight_remaining -= len(flight)
+    return flight, rest
+
+
+class PhasedDeflate:
+    """
+    A zlib (`wbits` 15) or gzip (`wbits` 31) compressor running at
+    `flight_level` for the first `flight_size` bytes, sync-flushed after every
+    chunk, then at `level`. zlib's deflateParams is not exposed to Python, so
+    the second phase is a raw compressor primed with the last window of input,
+    continuing the same deflate stream; the trailer is then written here.
+    """
+
+    def __init__(
+        self, wbits: int, level: int, flight_size: int, flight_level: int
+    ) -> None:
+        self.gzip = wbits == 31
+        self.level = level
+        self.flight_remaining = flight_size
+        self.compressobj = zlib.compressobj(flight_level, zlib.DEFLATED, wbits)
+        self.switched = False
+        self.history = b""
+        self.checksum = zlib.crc32(b"") if self.gzip else zlib.adler32(b"")
+        self.length = 0
+
+    def compress(self, data: bytes) -> bytes:
+        if self.gzip:
+            self.checksum = zlib.crc32(data, self.checksum)
+        else:
+            self.checksum = zlib.adler32(data, self.checksum)
+        self.length += len(data)
+
+        if not self.flight_remaining:
+            return self.compressobj.compress(data)
+
+        flight, data = split_flight(self, data)
+        self.history = (self.history + flight)[-WINDOW_SIZE:]
+        compressed_data = self.compressobj.compress(flight) + self.compressobj.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        if not self.flight_remaining:
+            self.compressobj = zlib.compressobj(
+                self.level, zlib.DEFLATED, -15, zdict=self.history
+            )
+            self.switched = True
+            compressed_data += self.compressobj.compress(data)
+
+        return compressed_data
+
+    def flush(self, mode: int = zlib.Z_FINISH) -> bytes:
+        compressed_data = self.compressobj.flush(mode)
+        if not self.switched:
+            return compressed_data
+
+        if self.gzip:
+            trailer = struct.pack("<II", self.checksum, self.length & 0xFFFFFFFF)
+        else:
+            trailer = struct.pack(">I", self.checksum)
+        return compressed_data + trailer
+
+
+def get_encoder(encoding_name: str) -> Optional[Type[BaseEncoder]]:
+    for encoder in BaseEncoder.__subclasses__():
+        if encoder.encoding_name == encoding_name and encoder.available():
+            return encoder
+    return None
+
+
 class Compressor:
     def __init__(
         self,
         minimum_length: int,
         include_mediatype: Collection[str],
         scope: Scope,
+        level: Level = None,
+        probe_size: int = 0,
+        minimum_gain: float = 0.0,
+        slice_size: int = 0,
+        strip_accept_ranges: bool = False,
+        tiers: Optional[Mapping[str, Sequence[Tier]]] = None,
+        limiter: Optional["CompressionLimiter"] = None,
+        streaming_mediatype: Collection[str] = (),
+        first_flight: Optional[Tuple[int, Level]] = None,
+        transcode: bool = False,
+        tracker: Optional["CompressibilityTracker"] = None,
+        hints: Optional["NetworkHints"] = None,
     ) -> None:
         self.request_engine_cls = None
+        self.engine: Optional[BaseEncoder] = None
+        self.accepted_encodings = {}
         self.minimum_length = minimum_length
         self.include_mediatype = include_mediatype
+        self.scope = scope
+        self.level = level
+        self.probe_size = probe_size
+        self.minimum_gain = minimum_gain
+        self.slice_size = slice_size
+        self.strip_accept_ranges = strip_accept_ranges
+        self.tiers = tiers
+        self.limiter = limiter
+        self.holds_slot = False
+        self.streaming_mediatype = streaming_mediatype
+        self.first_flight = first_flight
+        self.transcode = transcode
+        self.transcoding = False
+        self.tracker = tracker
+        self.route_key = None
+        self.learned_skip = False
+        self.stats: Optional["EncoderStats"] = None
+        self.vary: Tuple[bytes, ...] = (b"accept-encoding",)
 
         if scope["type"] == "http":
             headers = Headers(scope=scope)
 
-            request_accepted_encodings = headers.getacceptedencodings()
+            self.accepted_encodings = headers.getacceptedencodings()
             for compressor in BaseEncoder.__subclasses__():
-                if compressor.encoding_name in request_accepted_encodings:
+                if (
+                    compressor.encoding_name in self.accepted_encodings
+                    and compressor.available()
+                ):
                     self.request_engine_cls = compressor
                     break
 
+            if hints is not None:
+                self.vary += hints.vary
+                self.apply_profile(hints.profile(scope))
+
+    def apply_profile(self, profile: Optional[Tuple[Optional[str], Level]]) -> None:
+        """
+        Prefers the encoder and level picked from the client's network hints.
+        Explicit level overrides win over the hinted level.
+        """
+        if profile is None or self.request_engine_cls is None:
+            return
+
+        encoding_name, level = profile
+        if self.accepted_encodings.get(encoding_name, 0) != 0:
+            self.request_engine_cls = (
+                get_encoder(encoding_name) or self.request_engine_cls
+            )
+        if self.level is None:
+            self.level = level
+
     def __bool__(self):
-        return bool(self.request_engine_cls)
+        # a transcoding response may need decoding for clients accepting nothing
+        return bool(self.request_engine_cls) or (
+            self.transcode and self.scope["type"] == "http"
+        )
+
+    def is_compressible(self, data: bytes) -> bool:
+        sample = data[: self.probe_size]
+        if not self.probe_size or len(sample) < self.minimum_length:
+            return True
+
+        return len(zlib.compress(sample, 1)) <= len(sample) * (1 - self.minimum_gain)
+
+    def select_tier(
+        self, response_mimetype: str, content_length: float
+    ) -> Tuple[Type[BaseEncoder], Level]:
+        """
+        Picks the first tier covering `content_length` whose encoding the client
+        accepts with a nonzero q-value, falling back to the negotiated encoder at
+        its default level.
+        """
+        tiers = self.tiers.get(response_mimetype) or self.tiers.get(
+            response_mimetype.partition("/")[0] + "/*", self.tiers.get("*", ())
+        )
+        for largest, encoding_name, level in tiers:
+            if largest is not None and content_length > largest:
+                continue
+            if self.accepted_encodings.get(encoding_name, 0) != 0:
+                encoder = get_encoder(encoding_name)
+                if encoder:
+                    return encoder, level
+
+        return self.request_engine_cls, None
+
+    def refuses(self, start_event: HTTPResponseStartEvent, level: Level) -> bool:
+        """True when the request or the response headers rule compression out."""
+        return (
+            (self.request_engine_cls is None)
+            or (level is False)
+            or (start_event["status"] == 206)
+            or self.response_headers.content_range
+            or (bool(self.response_headers.content_encoding) and not self.transcode)
+            or (self.response_headers.mimetype not in self.include_mediatype)
+            or self.learned_skip
+        )
+
+    def select_engine_from_headers(self, start_event: HTTPResponseStartEvent) -> bool:
+        """
+        Chooses the engine before any body arrives when the headers settle it:
+        identity for refused or declared-short responses, streaming compression
+        for `streaming_mediatype` and for declared lengths above `slice_size`.
+        Returns False, choosing nothing, when the first body is needed.
+        """
+        self.response_headers = ResponseHeaders(start_event["headers"])
+        declared_length = self.response_headers.content_length
+        level = self.scope.get("state", {}).get(OVERRIDE_STATE_KEY, self.level)
+        self.streaming = True
+
+        if self.tracker is not None:
+            self.route_key = self.tracker.route_key(
+                self.scope, self.response_headers.mimetype
+            )
+            self.learned_skip = self.tracker.skips(self.route_key)
+
+        if self.transcode and self.response_headers.content_encoding:
+            self.select_transcoding(start_event, level)
+            return True
+
+        if self.refuses(start_event, level) or (
+            declared_length is not None and declared_length < self.minimum_length
+        ):
+            self.engine = BaseEncoder(self.response_headers.mimetype)
+            return True
+
+        if self.probe_size:
+            return False
+
+        if self.response_headers.mimetype in self.streaming_mediatype or (
+            declared_length is not None and 0 < self.slice_size < declared_length
+        ):
+            self.start_engine(level, declared_length or float("inf"))
+            return True
+
+        return False
 
-    def response_init(
+    def select_transcoding(
+        self, start_event: HTTPResponseStartEvent, level: Level
+    ) -> None:
+        """
+        Decodes a response already compressed upstream and re-encodes it with
+        the negotiated encoder, or sends it decoded when the client accepts
+        none. Passes it through untouched when the client accepts the upstream
+        coding, the coding is unknown or stacked, or the response is partial.
+        """
+        from .transcoding import TranscodingEncoder, get_decoder
+
+        response_mimetype = self.response_headers.mimetype
+        codings = self.response_headers.content_encoding
+        decoder_cls = get_decoder(codings[0]) if len(codings) == 1 else None
+
+        if (
+            decoder_cls is None
+            or self.accepted_encodings.get(codings[0], 0) != 0
+            or start_event["status"] == 206
+            or self.response_headers.content_range
+        ):
+            self.engine = BaseEncoder(response_mimetype)
+            return
+
+        if self.refuses(start_event, level):
+            self.engine = BaseEncoder(response_mimetype)
+        else:
+            self.start_engine(level, self.response_headers.content_length or 0)
+
+        self.engine = TranscodingEncoder(decoder_cls(), self.engine)
+        self.transcoding = True
+
+    def select_engine(
         self,
         start_event: HTTPResponseStartEvent,
         body_event: HTTPResponseBodyEvent,
-    ):
-        self.response_headers = MutableHeaders(raw=start_event["headers"])
-
-        has_more_body = body_event.get("more_body", False)
+    ) -> bool:
+        """
+        Chooses the engine for the response from its headers and first body.
+        Returns True when the body is going to be streamed; single bodies are
+        compressed by the caller and passed to `apply_single_body`.
+        """
+        self.response_headers = ResponseHeaders(start_event["headers"])
+
+        body = body_event["body"]
+        self.streaming = body_event.get("more_body", False) or (
+            0 < self.slice_size < len(body)
+        )
 
         content_length = (
-            int(self.response_headers.get("content-length", 0))
-            if not has_more_body
+            (self.response_headers.content_length or 0)
+            if not self.streaming
             else float("inf")
         )
-        response_mimetype = (
-            self.response_headers.get("content-type", "").partition(";")[0].strip()
-        )
+        level = self.scope.get("state", {}).get(OVERRIDE_STATE_KEY, self.level)
 
         if (
-            (self.request_engine_cls is None)
-            or (response_mimetype not in self.include_mediatype)
+            self.refuses(start_event, level)
             or (content_length < self.minimum_length)
+            or not self.is_compressible(body)
         ):
-            self.engine = BaseEncoder(response_mimetype)
+            self.engine = BaseEncoder(self.response_headers.mimetype)
         else:
-            self.engine = self.request_engine_cls(response_mimetype)
+            self.start_engine(
+                level,
+                (
+                    content_length
+                    if not self.streaming
+                    else self.response_headers.content_length or float("inf")
+                ),
+            )
+
+        return self.streaming
+
+    def start_engine(self, level: Level, content_length: float) -> None:
+        response_mimetype = self.response_headers.mimetype
 
-        body_event["body"] = self.engine.compress(body_event["body"], not has_more_body)
+        if self.limiter is not None:
+            limited = self.limiter.acquire()
+            self.holds_slot = limited is None
+            if limited is False:
+                self.engine = BaseEncoder(response_mimetype)
+                return
+            if limited is not None:
+                level = limited
+
+        if self.tiers:
+            engine_cls, tier_level = self.select_tier(response_mimetype, content_length)
+            self.engine = engine_cls(
+                response_mimetype, tier_level if level is None else level
+            )
+        else:
+            self.engine = self.request_engine_cls(response_mimetype, level)
+
+        # a first flight of no bytes disables it
+        if self.streaming and self.first_flight and self.first_flight[0] > 0:
+            self.engine.first_flight(*self.first_flight)
+
+        if self.tracker is not None and self.engine.encoding_name:
+            from .instrumentation import EncoderStats, instrument
+
+            self.stats = EncoderStats()
+            instrument(self.engine, self.stats)
+
+    def consume(self, length: int) -> None:
+        if self.limiter is not None and self.engine.encoding_name:
+            self.limiter.consume(length)
+
+    def release(self) -> None:
+        if self.holds_slot:
+            self.holds_slot = False
+            self.limiter.release()
+
+    def abort(self) -> None:
+        """
+        Gives up the response: frees the limiter slot and replaces the engine
+        with the identity, so its compression state can be collected.
+        """
+        self.release()
+        self.transcoding = False
+        if self.engine is not None:
+            self.engine = BaseEncoder(self.engine.mimetype)
+
+    def learn(self) -> None:
+        """Feeds what the response's encoder did to the tracker."""
+        if self.stats is not None and self.stats.bytes_in:
+            self.tracker.observe(
+                self.route_key,
+                self.stats.bytes_in,
+                self.stats.bytes_out,
+                self.stats.compress_time,
+            )
 
-        if self.engine.encoding_name:
-            self.response_headers["content-encoding"] = self.engine.encoding_name
-            self.response_headers.add_vary_header("accept-encoding")
-            if not has_more_body:
-                self.response_headers["content-length"] = str(
-                    self.engine.content_length
+    def store_key(self, body: bytes) -> bytes:
+        """
+        Identifies the compressed form of `body`: the engine and media type,
+        plus the host, path, query string and a strong ETag when the response
+        has one, since an ETag only identifies a body within one resource;
+        otherwise a digest of the body, so identical bodies share one entry.
+        """
+        import hashlib
+
+        etag = self.response_headers.etag
+        if etag and not etag.startswith(b"W/"):
+            identity = b"\0".join(
+                (
+                    Headers(scope=self.scope).get("host", "").encode("latin-1"),
+                    self.scope["path"].encode("utf-8", "surrogateescape"),
+                    self.scope.get("query_string", b""),
+                    etag,
                 )
+            )
+        else:
+            identity = hashlib.blake2b(body, digest_size=16).digest()
+
+        return b"%s:%d:%s:%s" % (
+            self.engine.encoding_name.encode(),
+            self.engine.level,
+            self.engine.mimetype.encode("latin-1"),
+            identity,
+        )
+
+    @property
+    def passthrough(self) -> bool:
+        """True when the body is forwarded unchanged."""
+        return not self.engine.encoding_name and not self.transcoding
+
+    def rewrite_headers(self, start_event: HTTPResponseStartEvent) -> None:
+        if not self.passthrough:
+            start_event["headers"] = self.response_headers.rebuild(
+                self.engine.encoding_name,
+                None if self.streaming else self.engine.content_length,
+                self.strip_accept_ranges,
+                self.vary,
+            )
+
+    def apply_single_body(
+        self,
+        start_event: HTTPResponseStartEvent,
+        body_event: HTTPResponseBodyEvent,
+        compressed_data: bytes,
+    ) -> None:
+        body = body_event["body"]
+        body_event["body"] = compressed_data
+
+        if self.engine.content_length >= len(body):
+            self.engine = BaseEncoder(self.engine.mimetype)
+            body_event["body"] = self.engine.compress(body, True)
+
+        self.rewrite_headers(start_event)
+
+    def apply_byte_range(
+        self, start_event: HTTPResponseStartEvent, body_event: HTTPResponseBodyEvent
+    ) -> None:
+        """
+        Answers a single `Range` request with a 206 over the compressed body.
+        Only responses identified by a strong ETag qualify, since the ETag
+        pins the stored representation. The ETag is made specific to the
+        coding, as byte offsets differ between codings, and `If-Range` must
+        match that.
+        """
+        etag = self.response_headers.etag
+        if (
+            start_event["status"] != 200
+            or not self.engine.encoding_name
+            or not etag
+            or etag.startswith(b"W/")
+        ):
+            return
+
+        suffix = b"-" + self.engine.encoding_name.encode("latin-1")
+        if etag.endswith(b'"'):
+            etag = etag[:-1] + suffix + b'"'
+        else:
+            etag += suffix
+        start_event["headers"] = [
+            (key, etag if key == b"etag" else value)
+            for key, value in start_event["headers"]
+        ]
+
+        request_headers = Headers(scope=self.scope)
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range.encode("latin-1") != etag:
+            return
+
+        body = body_event["body"]
+        byte_range = parse_byte_range(request_headers.get("range"), len(body))
+        if byte_range is None:
+            return
+
+        first, last = byte_range
+        body_event["body"] = body[first : last + 1]
+        start_event["status"] = 206
+        start_event["headers"] = [
+            *(item for item in start_event["headers"] if item[0] != b"content-length"),
+            (b"content-range", b"bytes %d-%d/%d" % (first, last, len(body))),
+            (b"content-length", str(last - first + 1).encode()),
+        ]
@@ -0,0 +1,111 @@
+import functools
+import struct
+import zlib
+from typing import Iterable, List, Tuple
+
+WINDOW_SIZE = 32768
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def gf2_matrix_times(matrix: List[int], vector: int) -> int:
+    total = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+    return total
+
+
+def gf2_matrix_square(matrix: List[int]) -> List[int]:
+    return [gf2_matrix_times(matrix, row) for row in matrix]
+
+
+@functools.lru_cache(maxsize=32)
+def crc32_zeros_operator(length: int) -> List[int]:
+    """GF(2) matrix appending `length` zero bytes to a CRC-32 register."""
+    operator = [1 << n for n in range(32)]
+
+    # operator for a single zero bit, squared three times into a zero byte
+    power = [0xEDB88320, *(1 << n for n in range(31))]
+    for _ in range(3):
+        power = gf2_matrix_square(power)
+
+    while length:
+        if length & 1:
+            operator = [gf2_matrix_times(power, row) for row in operator]
+        length >>= 1
+        if length:
+            power = gf2_matrix_square(power)
+
+    return operator
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    CRC-32 of two concatenated blocks, as zlib's crc32_combine. Operators are
+    cached per length, and all blocks but the last share one.
+    """
+    return gf2_matrix_times(crc32_zeros_operator(length2), crc1) ^ crc2
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Adler-32 of two concatenated blocks, as zlib's adler32_combine."""
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (
+        sum2 + ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + base - remainder
+    ) % base
+    return sum1 | (sum2 << 16)
+
+
+def deflate_block(
+    block: memoryview, dictionary: bytes, level: int, checksum, last_block: bool
+) -> Tuple[bytes, int, int]:
+    """
+    Raw-deflates one block primed with the tail of the previous one. Every
+    block but the last ends with a sync flush, so the outputs concatenate into
+    a single deflate stream.
+    """
+    if dictionary:
+        compressobj = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressobj = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    deflated = compressobj.compress(block) + compressobj.flush(
+        zlib.Z_FINISH if last_block else zlib.Z_SYNC_FLUSH
+    )
+    return deflated, checksum(block), len(block)
+
+
+def frame_blocks(
+    gzip: bool, level: int, blocks: Iterable[Tuple[bytes, int, int]]
+) -> bytes:
+    """
+    Wraps `(deflated, checksum, length)` blocks, the last one finished, in a
+    gzip or zlib header and trailer, combining their checksums and lengths.
+    """
+    if gzip:
+        combine, total = crc32_combine, zlib.crc32(b"")
+    else:
+        combine, total = adler32_combine, zlib.adler32(b"")
+
+    deflated_blocks = []
+    length = 0
+    for deflated, block_checksum, block_length in blocks:
+        total = combine(total, block_checksum, block_length)
+        deflated_blocks.append(deflated)
+        length += block_length
+
+    if gzip:
+        header = GZIP_HEADER
+        trailer = struct.pack("<II", total, length & 0xFFFFFFFF)
+    else:
+        header = zlib.compress(b"", level)[:2]
+        trailer = struct.pack(">I", total)
+
+    return b"".join((header, *deflated_blocks, trailer))
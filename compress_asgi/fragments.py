@@ -0,0 +1,90 @@
+import zlib
+from typing import Sequence, Union
+
+from .compressors import BaseEncoder, HTTPResponseBodyEvent
+from .deflate_tools import deflate_block, frame_blocks
+
+FRAGMENTS_KEY = "compress_asgi.fragments"
+STITCHED_ENCODINGS = ("gzip", "deflate")
+# loading a full 32 KiB window as dictionary costs more than compressing a
+# typical dynamic part, and the nearest context matches best anyway
+PRIMING_SIZE = 4096
+
+
+class Fragment:
+    """
+    A static part of a response deflated once, ending on a sync flush so its
+    output can be spliced into any deflate stream. Keep instances around (e.g.
+    at module level) and reuse them across responses.
+    """
+
+    __slots__ = ("data", "deflated", "crc32", "adler32")
+
+    def __init__(self, data: bytes, level: int = 9) -> None:
+        compressobj = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self.data = data
+        self.deflated = compressobj.compress(data) + compressobj.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        self.crc32 = zlib.crc32(data)
+        self.adler32 = zlib.adler32(data)
+
+
+Part = Union[Fragment, bytes]
+
+
+def fragments_body(
+    parts: Sequence[Part], more_body: bool = False
+) -> HTTPResponseBodyEvent:
+    """
+    Body event carrying `parts` for the middleware to stitch. Its `body` holds
+    the joined bytes, so servers and encoders that cannot stitch still send
+    the full content.
+    """
+    return {
+        "type": "http.response.body",
+        "body": b"".join(
+            part.data if isinstance(part, Fragment) else part for part in parts
+        ),
+        "more_body": more_body,
+        FRAGMENTS_KEY: tuple(parts),
+    }
+
+
+def stitch(engine: BaseEncoder, parts: Sequence[Part]) -> bytes:
+    """
+    One gzip or deflate stream of `parts`: fragments are copied as deflated,
+    only raw bytes are compressed, each primed with the part before it.
+    """
+    gzip = engine.encoding_name == "gzip"
+    checksum = zlib.crc32 if gzip else zlib.adler32
+    blocks = []
+    previous = b""
+
+    for index, part in enumerate(parts):
+        last_part = index == len(parts) - 1
+        if isinstance(part, Fragment):
+            blocks.append(
+                (part.deflated, part.crc32 if gzip else part.adler32, len(part.data))
+            )
+            previous = part.data
+        else:
+            blocks.append(
+                deflate_block(
+                    part,
+                    previous[-PRIMING_SIZE:],
+                    engine.level,
+                    checksum,
+                    last_part,
+                )
+            )
+            previous = part
+
+    if not parts or isinstance(parts[-1], Fragment):
+        # an empty final block closes streams ending on a fragment
+        final_block = zlib.compressobj(1, zlib.DEFLATED, -15).flush()
+        blocks.append((final_block, checksum(b""), 0))
+
+    compressed_data = frame_blocks(gzip, engine.level, blocks)
+    engine.content_length = len(compressed_data)
+    return compressed_data
@@ -1,41 +1,23 @@
 import typing
 
-try:
-    from starlette.datastructures import Headers as StarletteHeaders
-    from starlette.datastructures import MutableHeaders
-except ModuleNotFoundError:
-    StarletteHeaders = None
-    MutableHeaders = None
-
-if not StarletteHeaders:
-
-    class StarletteHeaders:
-        def __init__(
-            self,
-            raw: typing.Optional[typing.List[typing.Tuple[bytes, bytes]]] = None,
-            scope: typing.Optional[typing.MutableMapping[str, typing.Any]] = None,
-        ) -> None:
-            assert raw is None or scope is None, 'Cannot set both "raw" and "scope".'
-            if raw:
-                self._list = raw
-            else:
-                self._list = scope["headers"]
-
-        def get(self, key: str, default: typing.Any = None) -> typing.Any:
-            try:
-                return self[key]
-            except KeyError:
-                return default
-
-        def __getitem__(self, key: str) -> str:
-            get_header_key = key.lower().encode("latin-1")
-            for header_key, header_value in self._list:
-                if header_key == get_header_key:
-                    return header_value.decode("latin-1")
-            raise KeyError(key)
-
-
-class Headers(StarletteHeaders):
+
+class Headers:
+    def __init__(self, scope: typing.MutableMapping[str, typing.Any]) -> None:
+        self._list = scope["headers"]
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key: str) -> str:
+        get_header_key = key.lower().encode("latin-1")
+        for header_key, header_value in self._list:
+            if header_key == get_header_key:
+                return header_value.decode("latin-1")
+        raise KeyError(key)
+
     @staticmethod
     def parseEncoding(encoding: str):
         enc, sep, q = encoding.partition(";q=")
@@ -62,33 +44,112 @@ class Headers(StarletteHeaders):
         return user_accepted_encodings
 
 
-if not MutableHeaders:
-
-    class MutableHeaders(Headers):
-        def __setitem__(self, key: str, value: str) -> None:
-            """
-            Set the header `key` to `value`, removing any duplicate entries.
-            Retains insertion order.
-            """
-            set_key = key.lower().encode("latin-1")
-            set_value = value.encode("latin-1")
-
-            found_indexes = []
-            for idx, (item_key, item_value) in enumerate(self._list):
-                if item_key == set_key:
-                    found_indexes.append(idx)
-
-            for idx in reversed(found_indexes[1:]):
-                del self._list[idx]
-
-            if found_indexes:
-                idx = found_indexes[0]
-                self._list[idx] = (set_key, set_value)
-            else:
-                self._list.append((set_key, set_value))
-
-        def add_vary_header(self, vary: str) -> None:
-            existing = self.get("vary")
-            if existing is not None:
-                vary = ", ".join([existing, vary])
-            self["vary"] = vary
+def parse_byte_range(
+    header: typing.Optional[str], length: int
+) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    The first and last offsets of a single `Range: bytes=...` request over
+    `length` bytes, or None when the header is absent, unsatisfiable or asks
+    for several ranges, which are then ignored.
+    """
+    if not header:
+        return None
+
+    unit, _, spec = header.partition("=")
+    first, sep, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or not sep or "," in spec:
+        return None
+
+    try:
+        if not first:
+            return max(length - int(last), 0), length - 1
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    except ValueError:
+        return None
+
+    if start > end:
+        return None
+    return start, end
+
+
+RawHeaders = typing.List[typing.Tuple[bytes, bytes]]
+
+REWRITTEN_RESPONSE_HEADERS = frozenset(
+    (b"content-encoding", b"content-length", b"vary")
+)
+
+
+class ResponseHeaders:
+    """
+    Collects every response header the compressor needs in a single pass over
+    the raw ASGI header list. Keys are compared as sent by the application,
+    which the ASGI spec requires to be lowercased.
+    """
+
+    __slots__ = (
+        "raw",
+        "content_length",
+        "content_type",
+        "content_range",
+        "vary",
+        "etag",
+        "content_encoding",
+    )
+
+    def __init__(self, raw: RawHeaders) -> None:
+        self.raw = raw
+        self.content_length: typing.Optional[int] = None
+        self.content_type = b""
+        self.content_range = False
+        self.vary: typing.List[bytes] = []
+        self.etag = b""
+        self.content_encoding: typing.List[str] = []
+
+        for key, value in raw:
+            if key == b"content-type":
+                self.content_type = value
+            elif key == b"content-length":
+                self.content_length = int(value)
+            elif key == b"vary":
+                self.vary.append(value)
+            elif key == b"content-range":
+                self.content_range = True
+            elif key == b"etag":
+                self.etag = value
+            elif key == b"content-encoding":
+                self.content_encoding.extend(
+                    coding
+                    for coding in (
+                        token.strip().lower().decode("latin-1")
+                        for token in value.split(b",")
+                    )
+                    if coding and coding != "identity"
+                )
+
+    @property
+    def mimetype(self) -> str:
+        return self.content_type.partition(b";")[0].strip().decode("latin-1")
+
+    def rebuild(
+        self,
+        content_encoding: str,
+        content_length: typing.Optional[int],
+        strip_accept_ranges: bool = False,
+        vary: typing.Sequence[bytes] = (b"accept-encoding",),
+    ) -> RawHeaders:
+        rewritten = (
+            REWRITTEN_RESPONSE_HEADERS | {b"accept-ranges"}
+            if strip_accept_ranges
+            else REWRITTEN_RESPONSE_HEADERS
+        )
+        headers = [
+            *(item for item in self.raw if item[0] not in rewritten),
+            (b"vary", b", ".join((*self.vary, *vary))),
+        ]
+        if content_encoding:
+            headers.append((b"content-encoding", content_encoding.encode("latin-1")))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+
+        return headers
@@ -0,0 +1,76 @@
+import functools
+from typing import Collection, Optional, Tuple, TypeVar
+
+from .compressors import Level
+
+try:
+    from asgiref.typing import Scope
+except ModuleNotFoundError:
+    Scope = TypeVar("Scope")
+
+# (preferred encoding name or None to keep the negotiated one, level)
+Profile = Tuple[Optional[str], Level]
+
+
+class NetworkHints:
+    """
+    Adjusts the negotiated encoder and level from the `Save-Data`, `ECT` and
+    `Downlink` request hints. Clients saving data, on an `ECT` in `slow_ect` or
+    with a downlink of at most `slow_downlink` Mbps get `slow_encoding` (when
+    they accept it) at `slow_level`; clients with a downlink of at least
+    `fast_downlink` Mbps get `fast_encoding` at `fast_level`. Other clients
+    are left alone.
+
+    Hint values are classified once per distinct combination, in an LRU cache
+    of `cache_size` entries, and requests without hints skip it entirely.
+    """
+
+    vary = (b"save-data", b"ect", b"downlink")
+
+    def __init__(
+        self,
+        slow_encoding: Optional[str] = "br",
+        slow_level: Level = "best",
+        fast_encoding: Optional[str] = None,
+        fast_level: Level = "fastest",
+        slow_ect: Collection[str] = ("slow-2g", "2g", "3g"),
+        slow_downlink: float = 1.5,
+        fast_downlink: float = 10.0,
+        cache_size: int = 256,
+    ) -> None:
+        self.slow: Profile = (slow_encoding, slow_level)
+        self.fast: Profile = (fast_encoding, fast_level)
+        self.slow_ect = frozenset(ect.encode("latin-1") for ect in slow_ect)
+        self.slow_downlink = slow_downlink
+        self.fast_downlink = fast_downlink
+        self.classify = functools.lru_cache(maxsize=cache_size)(self.parse)
+
+    def parse(self, save_data: bytes, ect: bytes, downlink: bytes) -> Optional[Profile]:
+        if save_data.strip().lower() == b"on":
+            return self.slow
+        if ect.strip().lower() in self.slow_ect:
+            return self.slow
+
+        try:
+            speed = float(downlink)
+        except ValueError:
+            return None
+        if speed <= self.slow_downlink:
+            return self.slow
+        if speed >= self.fast_downlink:
+            return self.fast
+        return None
+
+    def profile(self, scope: Scope) -> Optional[Profile]:
+        save_data = ect = downlink = b""
+        for key, value in scope.get("headers", ()):
+            if key == b"save-data":
+                save_data = value
+            elif key == b"ect":
+                ect = value
+            elif key == b"downlink":
+                downlink = value
+
+        if not (save_data or ect or downlink):
+            return None
+        return self.classify(save_data, ect, downlink)
@@ -0,0 +1,30 @@
+import time
+
+from .compressors import BaseEncoder
+
+
+class EncoderStats:
+    __slots__ = ("compress_time", "bytes_in", "bytes_out")
+
+    def __init__(self) -> None:
+        self.compress_time = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+def instrument(engine: BaseEncoder, stats: EncoderStats) -> None:
+    """
+    Wraps `engine.compress` on the instance, so every caller (single body,
+    sliced streaming or a batcher thread) is accounted in `stats`.
+    """
+    compress = engine.compress
+
+    def timed_compress(data: bytes, last_chunk: bool = False) -> bytes:
+        started = time.perf_counter()
+        compressed_data = compress(data, last_chunk)
+        stats.compress_time += time.perf_counter() - started
+        stats.bytes_in += len(data)
+        stats.bytes_out += len(compressed_data)
+        return compressed_data
+
+    engine.compress = timed_compress
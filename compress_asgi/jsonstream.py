@@ -0,0 +1,134 @@
+import itertools
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional, Tuple, Union
+
+from .compressors import BaseEncoder, load_backend
+
+if TYPE_CHECKING:  # pragma: no cover
+    from concurrent.futures import Executor
+
+JSON_STREAM_EXTENSION = "compress_asgi.json_stream"
+DEFAULT_SLICE_SIZE = 65536
+
+Dumps = Callable[[Any], bytes]
+
+
+def json_dumps(obj: Any) -> bytes:
+    import json
+
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def get_dumps(serializer: Union[str, Dumps]) -> Dumps:
+    """`serializer` as a callable; "orjson" falls back to json when missing."""
+    if callable(serializer):
+        return serializer
+    if serializer == "orjson":
+        orjson = load_backend("orjson")
+        if orjson is not None:
+            return orjson.dumps
+    return json_dumps
+
+
+class JSONSlices:
+    """
+    Serializes `items` as one JSON array, a slice of about `slice_size` bytes
+    at a time, so only one slice is held at once. Items are serialized in
+    batches, as lists with their brackets cut, sized from the bytes per item
+    seen so far: one `dumps` call per slice costs far less than one per item.
+    """
+
+    def __init__(self, items: Iterable[Any], dumps: Dumps, slice_size: int) -> None:
+        self.iterator = iter(items)
+        self.dumps = dumps
+        self.slice_size = slice_size
+        self.batch_size = 16
+        self.count = 0
+        self.done = False
+
+    def next_slice(self) -> bytes:
+        parts = [b"["] if not self.count else []
+        size = 0
+
+        while size < self.slice_size:
+            batch = list(itertools.islice(self.iterator, self.batch_size))
+            if not batch:
+                parts.append(b"]")
+                self.done = True
+                break
+
+            encoded = self.dumps(batch)[1:-1]
+            if self.count:
+                parts.append(b",")
+            parts.append(encoded)
+            self.count += len(batch)
+            size += len(encoded) + 1
+            # aim the next batch at the rest of this slice, or a whole one
+            target = (
+                self.slice_size - size if size < self.slice_size else self.slice_size
+            )
+            self.batch_size = len(batch) * target // len(encoded) + 1
+
+        return b"".join(parts)
+
+
+async def send_json_items(
+    scope, send, items: Iterable[Any], serializer: Union[str, Dumps] = "json"
+) -> None:
+    """
+    Sends `items` as the JSON array body of a response whose start was sent.
+    Under a `CompressionMiddleware` with a `json_streamer`, the middleware
+    serializes and compresses the array slice by slice; otherwise it is
+    serialized here and sent in slices. `serializer` is "json", "orjson" or a
+    callable returning bytes, which must serialize lists as JSON arrays.
+    """
+    dumps = get_dumps(serializer)
+    if JSON_STREAM_EXTENSION in (scope.get("extensions") or {}):
+        await send({"type": JSON_STREAM_EXTENSION, "items": items, "dumps": dumps})
+        return
+
+    slices = JSONSlices(items, dumps, DEFAULT_SLICE_SIZE)
+    while not slices.done:
+        body = slices.next_slice()
+        await send(
+            {"type": "http.response.body", "body": body, "more_body": not slices.done}
+        )
+
+
+class JSONStreamer:
+    """
+    Lets applications hand an iterable of objects to the middleware through
+    `send_json_items`. The middleware serializes it `slice_size` bytes at a
+    time and feeds every slice to the response's encoder as it is produced,
+    so neither the whole serialized array nor its compressed copy is held.
+    With `threaded`, each slice after the first is serialized and compressed
+    in one call on an `executor` thread, off the event loop; this requires an
+    asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        slice_size: int = DEFAULT_SLICE_SIZE,
+        threaded: bool = False,
+        executor: Optional["Executor"] = None,
+    ) -> None:
+        self.slice_size = slice_size
+        self.threaded = threaded
+        self.executor = executor
+
+    def slices(self, send_event) -> JSONSlices:
+        return JSONSlices(send_event["items"], send_event["dumps"], self.slice_size)
+
+    @staticmethod
+    def compress_slice(slices: JSONSlices, engine: BaseEncoder) -> Tuple[int, bytes]:
+        body = slices.next_slice()
+        return len(body), engine.compress(body, slices.done)
+
+    async def fused_slice(
+        self, slices: JSONSlices, engine: BaseEncoder
+    ) -> Tuple[int, bytes]:
+        """Serializes and compresses the next slice on an executor thread."""
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.compress_slice, slices, engine
+        )
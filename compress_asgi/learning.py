@@ -0,0 +1,110 @@
+import threading
+from typing import Any, Dict, List, Mapping, Tuple
+
+RouteKey = Tuple[str, str]
+
+
+class RouteStats:
+    __slots__ = ("ratio", "ns_per_byte", "samples", "skipped")
+
+    def __init__(self) -> None:
+        self.ratio = 1.0
+        self.ns_per_byte = 0.0
+        self.samples = 0
+        self.skipped = 0
+
+
+class CompressibilityTracker:
+    """
+    Learns, per route and media type, an exponentially weighted mean of the
+    compression ratio (output over input bytes) and of the encoder time per
+    input byte. Once a route has `min_samples` responses and a mean ratio
+    above `max_ratio`, its responses are sent uncompressed, except every
+    `reprobe_every`-th one, which is compressed again to refresh the mean.
+
+    Routes are keyed by the route template when the framework puts one in the
+    scope (`scope["route"].path`, as FastAPI does), otherwise by the first
+    `prefix_segments` segments of the path. At most `max_routes` keys are
+    learned; later ones are always compressed.
+    """
+
+    def __init__(
+        self,
+        max_ratio: float = 0.95,
+        alpha: float = 0.1,
+        min_samples: int = 8,
+        reprobe_every: int = 64,
+        prefix_segments: int = 2,
+        max_routes: int = 1024,
+    ) -> None:
+        self.max_ratio = max_ratio
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.reprobe_every = reprobe_every
+        self.prefix_segments = prefix_segments
+        self.max_routes = max_routes
+
+        self.lock = threading.Lock()
+        self.routes: Dict[RouteKey, RouteStats] = {}
+
+    def route_key(self, scope: Mapping[str, Any], mimetype: str) -> RouteKey:
+        route = getattr(scope.get("route"), "path", None)
+        if route is None:
+            segments = scope.get("path", "/").split("/")
+            route = "/".join(segments[: self.prefix_segments + 1])
+
+        return route, mimetype
+
+    def poor(self, stats: RouteStats) -> bool:
+        return stats.samples >= self.min_samples and stats.ratio > self.max_ratio
+
+    def skips(self, key: RouteKey) -> bool:
+        """True when the response should not be compressed; counts re-probes."""
+        stats = self.routes.get(key)
+        if stats is None or not self.poor(stats):
+            return False
+
+        with self.lock:
+            stats.skipped += 1
+            return stats.skipped % self.reprobe_every != 0
+
+    def observe(
+        self, key: RouteKey, bytes_in: int, bytes_out: int, seconds: float
+    ) -> None:
+        ratio = bytes_out / bytes_in
+        ns_per_byte = seconds * 1e9 / bytes_in
+
+        with self.lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                if len(self.routes) >= self.max_routes:
+                    return
+                stats = self.routes[key] = RouteStats()
+
+            if stats.samples:
+                stats.ratio += self.alpha * (ratio - stats.ratio)
+                stats.ns_per_byte += self.alpha * (ns_per_byte - stats.ns_per_byte)
+            else:
+                stats.ratio, stats.ns_per_byte = ratio, ns_per_byte
+            stats.samples += 1
+
+    def table(self) -> List[Dict[str, Any]]:
+        """The learned statistics, one JSON-serializable row per route."""
+        with self.lock:
+            return [
+                {
+                    "route": route,
+                    "mimetype": mimetype,
+                    "ratio": round(stats.ratio, 4),
+                    "ns_per_byte": round(stats.ns_per_byte, 2),
+                    "samples": stats.samples,
+                    "skipping": self.poor(stats),
+                }
+                for (route, mimetype), stats in sorted(self.routes.items())
+            ]
+
+    def forget(self, route: str) -> None:
+        """Drops what was learned about `route`, so it is compressed again."""
+        with self.lock:
+            for key in [key for key in self.routes if key[0] == route]:
+                del self.routes[key]
@@ -0,0 +1,106 @@
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Union
+
+from .compressors import Level
+
+
+def current_window() -> int:
+    return int(time.monotonic())
+
+
+class ByteShard:
+    """Input bytes counted by one thread during one one-second window."""
+
+    __slots__ = ("window", "bytes", "__weakref__")
+
+    def __init__(self) -> None:
+        self.window = 0
+        self.bytes = 0
+
+
+class CompressionLimiter:
+    """
+    Caps the number of responses compressed at once and the input bytes
+    compressed per second. Over either limit, new responses get `fallback`
+    (False for identity, or a cheaper level such as "fastest") instead of
+    waiting.
+
+    Only `acquire` and `release`, once per response, take the lock. Bytes are
+    counted per thread in shards, which `acquire` sums, so compressing threads
+    never contend on the counter.
+    """
+
+    def __init__(
+        self,
+        max_streams: Optional[int] = None,
+        max_bytes_per_second: Optional[int] = None,
+        fallback: Union[Level, bool] = False,
+    ) -> None:
+        self.max_streams = max_streams
+        self.max_bytes_per_second = max_bytes_per_second
+        self.fallback = fallback
+
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.local = threading.local()
+        self.shards: "weakref.WeakSet[ByteShard]" = weakref.WeakSet()
+
+        self.compressed = 0
+        self.stream_fallbacks = 0
+        self.rate_fallbacks = 0
+
+    @property
+    def window_bytes(self) -> int:
+        window = current_window()
+        return sum(shard.bytes for shard in self.shards if shard.window == window)
+
+    def over_rate(self) -> bool:
+        if self.max_bytes_per_second is None:
+            return False
+
+        return self.window_bytes >= self.max_bytes_per_second
+
+    def acquire(self) -> Union[Level, bool, None]:
+        """
+        Registers a response about to be compressed. Returns None when it may
+        proceed, otherwise the fallback override, without taking a slot.
+        """
+        with self.lock:
+            if self.max_streams is not None and self.streams >= self.max_streams:
+                self.stream_fallbacks += 1
+                return self.fallback
+            if self.over_rate():
+                self.rate_fallbacks += 1
+                return self.fallback
+
+            self.streams += 1
+            self.compressed += 1
+            return None
+
+    def release(self) -> None:
+        with self.lock:
+            self.streams -= 1
+
+    def consume(self, length: int) -> None:
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.local.shard = ByteShard()
+            with self.lock:
+                self.shards.add(shard)
+
+        # only the owning thread writes its shard
+        window = current_window()
+        if shard.window != window:
+            shard.window, shard.bytes = window, 0
+        shard.bytes += length
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "streams": self.streams,
+            "compressed": self.compressed,
+            "stream_fallbacks": self.stream_fallbacks,
+            "rate_fallbacks": self.rate_fallbacks,
+        }
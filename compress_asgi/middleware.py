@@ -1,12 +1,35 @@
-from typing import Collection, TypeVar, Union
+import time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from .compressors import Compressor
+from .compressors import (
+    OVERRIDE_STATE_KEY,
+    BaseEncoder,
+    Compressor,
+    Level,
+    Tier,
+    check_level,
+)
 from .constants import DEFAULT_MIMES_INCLUDED, DEFAULT_MINIMUM_SIZE
+from .fragments import FRAGMENTS_KEY, STITCHED_ENCODINGS, Part, stitch
+from .instrumentation import EncoderStats
+from .jsonstream import JSON_STREAM_EXTENSION, JSONStreamer
+from .policy import load_policy
 
 try:
     from asgiref.typing import (
         ASGI3Application,
         ASGIReceiveCallable,
+        ASGIReceiveEvent,
         ASGISendCallable,
         HTTPDisconnectEvent,
         HTTPResponseBodyEvent,
@@ -18,6 +41,7 @@ try:
 except ModuleNotFoundError:
     ASGI3Application = TypeVar("ASGI3Application")
     ASGIReceiveCallable = TypeVar("ASGIReceiveCallable")
+    ASGIReceiveEvent = TypeVar("ASGIReceiveEvent")
     ASGISendCallable = TypeVar("ASGISendCallable")
     HTTPDisconnectEvent = TypeVar("HTTPDisconnectEvent")
     HTTPResponseBodyEvent = TypeVar("HTTPResponseBodyEvent")
@@ -25,6 +49,16 @@ except ModuleNotFoundError:
     HTTPServerPushEvent = TypeVar("HTTPServerPushEvent")
     Scope = TypeVar("Scope")
 
+if TYPE_CHECKING:  # pragma: no cover
+    from .batching import CompressionBatcher
+    from .clients import ClientRule
+    from .hints import NetworkHints
+    from .learning import CompressibilityTracker
+    from .limiter import CompressionLimiter
+    from .parallel import ParallelCompressor
+    from .recording import Recording, TrafficRecorder
+    from .store import BodyStore
+
 ASGIHTTPSendEvent = Union[
     HTTPResponseStartEvent,
     HTTPResponseBodyEvent,
@@ -39,21 +73,187 @@ class CompressionMiddleware:
         app: ASGI3Application,
         minimum_size: int = DEFAULT_MINIMUM_SIZE,
         include_mediatype: Collection[str] = DEFAULT_MIMES_INCLUDED,
+        path_overrides: Optional[Mapping[str, Union[Level, bool]]] = None,
+        probe_size: int = 0,
+        minimum_gain: float = 0.05,
+        stream_slice_size: int = 0,
+        batcher: Optional["CompressionBatcher"] = None,
+        prewarm: Collection[str] = (),
+        strip_accept_ranges: bool = False,
+        server_timing: bool = False,
+        parallel: Optional["ParallelCompressor"] = None,
+        tiers: Optional[Mapping[str, Sequence[Tier]]] = None,
+        client_rules: Sequence["ClientRule"] = (),
+        limiter: Optional["CompressionLimiter"] = None,
+        store: Optional["BodyStore"] = None,
+        streaming_mediatype: Collection[str] = (),
+        first_flight: Optional[Tuple[int, Level]] = None,
+        recorder: Optional["TrafficRecorder"] = None,
+        policy: Optional[str] = None,
+        transcode: bool = False,
+        tracker: Optional["CompressibilityTracker"] = None,
+        hints: Optional["NetworkHints"] = None,
+        json_streamer: Optional[JSONStreamer] = None,
     ) -> None:
         self.app = app
         self.minimum_size = minimum_size
-        self.include_mediatype = frozenset(include_mediatype)
+        self.streaming_mediatype = frozenset(streaming_mediatype)
+        self.include_mediatype = frozenset(include_mediatype) | self.streaming_mediatype
+        self.path_overrides = sorted(
+            (path_overrides or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+        self.probe_size = probe_size
+        self.minimum_gain = minimum_gain
+        self.stream_slice_size = stream_slice_size
+        self.batcher = batcher
+        self.parallel = parallel
+        self.prewarm_encodings = frozenset(prewarm)
+        self.strip_accept_ranges = strip_accept_ranges
+        self.tiers = {
+            **(load_policy(policy) if policy else {}),
+            **{
+                mimetype: tuple(mimetype_tiers)
+                for mimetype, mimetype_tiers in (tiers or {}).items()
+            },
+        }
+        self.client_rules = tuple(client_rules)
+        self.first_flight = first_flight
+        self.recorder = recorder
+        self.limiter = limiter
+        self.store = store
+        self.transcode = transcode
+        self.tracker = tracker
+        self.hints = hints
+        self.json_streamer = json_streamer
+        self.responder_cls = (
+            TimedCompressionResponder if server_timing else CompressionResponder
+        )
+        self.check_levels()
+
+    def check_levels(self) -> None:
+        for _, override in self.path_overrides:
+            check_level(override)
+        for rule in self.client_rules:
+            check_level(rule.override)
+        if self.limiter is not None:
+            check_level(self.limiter.fallback)
+        for mimetype_tiers in self.tiers.values():
+            for _, _, level in mimetype_tiers:
+                check_level(level, identity=False)
+        if self.first_flight:
+            check_level(self.first_flight[1], identity=False)
+        if self.hints is not None:
+            check_level(self.hints.slow[1], identity=False)
+            check_level(self.hints.fast[1], identity=False)
+
+    def prewarm(self) -> None:
+        for encoder in BaseEncoder.__subclasses__():
+            if encoder.encoding_name in self.prewarm_encodings and encoder.available():
+                encoder("text/plain").compress(b"", True)
+
+    def receive_with_prewarm(self, receive: ASGIReceiveCallable) -> ASGIReceiveCallable:
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.prewarm()
+            return message
+
+        return receive_wrapper
+
+    def resolve_override(self, scope: Scope) -> Union[Level, bool]:
+        state = scope.get("state", {})
+        if OVERRIDE_STATE_KEY in state:
+            return state[OVERRIDE_STATE_KEY]
+
+        for rule in self.client_rules:
+            if rule.matches(scope):
+                return rule.override
+
+        path = scope.get("path", "")
+        for prefix, override in self.path_overrides:
+            # whole segments only: "/downloads" does not cover "/downloads-x"
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return override
+
+        return None
 
     async def __call__(
         self, scope: Scope, receive: ASGIReceiveCallable, send: ASGISendCallable
     ) -> None:
-        compressor = Compressor(self.minimum_size, self.include_mediatype, scope)
+        if scope["type"] == "lifespan" and self.prewarm_encodings:
+            await self.app(scope, self.receive_with_prewarm(receive), send)
+            return
+
+        # sampled before any bypass, so the recording covers every response
+        recording = (
+            self.recorder.sample(scope)
+            if self.recorder is not None and scope["type"] == "http"
+            else None
+        )
+
+        override = self.resolve_override(scope)
+        if override is False:
+            await self.bypass(scope, receive, send, recording)
+            return
+
+        compressor = Compressor(
+            self.minimum_size,
+            self.include_mediatype,
+            scope,
+            level=override,
+            probe_size=self.probe_size,
+            minimum_gain=self.minimum_gain,
+            slice_size=self.stream_slice_size,
+            strip_accept_ranges=self.strip_accept_ranges,
+            tiers=self.tiers,
+            limiter=self.limiter,
+            streaming_mediatype=self.streaming_mediatype,
+            first_flight=self.first_flight,
+            transcode=self.transcode,
+            tracker=self.tracker,
+            hints=self.hints,
+        )
 
         if compressor:
-            responder = CompressionResponder(self.app, compressor)
+            if self.json_streamer is not None:
+                scope["extensions"] = {
+                    **(scope.get("extensions") or {}),
+                    JSON_STREAM_EXTENSION: {},
+                }
+            responder = self.responder_cls(
+                self.app,
+                compressor,
+                self.batcher,
+                self.parallel,
+                self.store,
+                recording,
+                self.json_streamer,
+            )
             await responder(scope, receive, send)
         else:
+            await self.bypass(scope, receive, send, recording)
+
+    async def bypass(
+        self,
+        scope: Scope,
+        receive: ASGIReceiveCallable,
+        send: ASGISendCallable,
+        recording: Optional["Recording"],
+    ) -> None:
+        """Runs the application untouched, recording its response if sampled."""
+        if recording is None:
             await self.app(scope, receive, send)
+            return
+
+        async def recorded_send(send_event: ASGIHTTPSendEvent) -> None:
+            recording.received(send_event)
+            recording.sent(send_event)
+            await send(send_event)
+
+        try:
+            await self.app(scope, receive, recorded_send)
+        finally:
+            recording.finish()
 
 
 class CompressionResponder:
@@ -61,31 +261,390 @@ class CompressionResponder:
         self,
         app: ASGI3Application,
         compressor: Compressor,
+        batcher: Optional["CompressionBatcher"] = None,
+        parallel: Optional["ParallelCompressor"] = None,
+        store: Optional["BodyStore"] = None,
+        recording: Optional["Recording"] = None,
+        json_streamer: Optional[JSONStreamer] = None,
     ) -> None:
         self.app = app
         self.compressor = compressor
+        self.batcher = batcher
+        self.parallel = parallel
+        self.store = store
+        self.recording = recording
+        self.json_streamer = json_streamer
 
         self.initial_send_event: HTTPResponseStartEvent = None
         self.send: ASGISendCallable = None
+        self.disconnected = False
+        self.stored = False
 
     async def __call__(
         self, scope: Scope, receive: ASGIReceiveCallable, send: ASGISendCallable
     ) -> None:
-        self.send = send
-        await self.app(scope, receive, self.send_with_compression)
+        recording = self.recording
+        if recording is None:
+            server_send = send
+            app_send = self.send_with_compression
+        else:
+
+            async def server_send(send_event: ASGIHTTPSendEvent) -> None:
+                recording.sent(send_event)
+                await send(send_event)
+
+            async def app_send(send_event: ASGIHTTPSendEvent) -> None:
+                recording.received(send_event)
+                await self.send_with_compression(send_event)
+
+        async def checked_send(send_event: ASGIHTTPSendEvent) -> None:
+            # servers report a gone client as an OSError, e.g. uvicorn's
+            # ClientDisconnected; anything else is a bug and leaves state alone
+            try:
+                await server_send(send_event)
+            except OSError:
+                self.client_disconnected()
+                raise
+
+        async def checked_receive() -> ASGIReceiveEvent:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.client_disconnected()
+            return message
+
+        self.send = checked_send
+        try:
+            await self.app(scope, checked_receive, app_send)
+        finally:
+            self.compressor.release()
+            self.compressor.learn()
+            if recording is not None:
+                recording.finish()
+
+    def client_disconnected(self) -> None:
+        """Drops the encoder; nothing the application sends is used anymore."""
+        self.disconnected = True
+        self.initial_send_event = None
+        self.compressor.abort()
 
     async def send_with_compression(self, send_event: ASGIHTTPSendEvent) -> None:
+        if self.disconnected:
+            return
+
         if send_event["type"] == "http.response.start":
-            self.initial_send_event = send_event
-        else:
-            if send_event["type"] == "http.response.body":  # pragma: no branch
-                if self.initial_send_event:
-                    self.compressor.response_init(self.initial_send_event, send_event)
-                    await self.send(self.initial_send_event)
-                    self.initial_send_event = None
+            if self.compressor.select_engine_from_headers(send_event):
+                self.compressor.rewrite_headers(send_event)
+                await self.send_start(send_event)
+            else:
+                self.initial_send_event = send_event
+        elif send_event["type"] == "http.response.body":
+            # the fragments only serve single bodies; never forward the key
+            fragments = send_event.pop(FRAGMENTS_KEY, None)
+            if self.initial_send_event:
+                streaming = await self.response_init(send_event, fragments)
+                if self.disconnected:
+                    # the client left while the body was being compressed
+                    return
+                await self.send(self.initial_send_event)
+                self.initial_send_event = None
+                if streaming:
+                    await self.send_body(send_event)
                 else:
-                    send_event["body"] = self.compressor.engine.compress(
-                        send_event["body"], not send_event.get("more_body", False)
-                    )
-                    
+                    await self.send(send_event)
+            else:
+                await self.send_body(send_event)
+        elif send_event["type"] == JSON_STREAM_EXTENSION:
+            await self.send_json_items(send_event)
+        else:
+            await self.send(send_event)
+
+    async def send_json_items(self, send_event) -> None:
+        slices = self.json_streamer.slices(send_event)
+        body = slices.next_slice()
+        if slices.done and self.initial_send_event:
+            # the whole array fits one slice: a single body of known length
+            self.initial_send_event["headers"] = [
+                *self.initial_send_event["headers"],
+                (b"content-length", str(len(body)).encode()),
+            ]
+        await self.send_with_compression(
+            {"type": "http.response.body", "body": body, "more_body": not slices.done}
+        )
+
+        while not slices.done and not self.disconnected:
+            if self.json_streamer.threaded and not self.compressor.passthrough:
+                length, compressed_data = await self.json_streamer.fused_slice(
+                    slices, self.compressor.engine
+                )
+                self.compressor.consume(length)
+                await self.send(
+                    {
+                        "type": "http.response.body",
+                        "body": compressed_data,
+                        "more_body": not slices.done,
+                    }
+                )
+            else:
+                body = slices.next_slice()
+                await self.send_body(
+                    {
+                        "type": "http.response.body",
+                        "body": body,
+                        "more_body": not slices.done,
+                    }
+                )
+
+    async def response_init(
+        self,
+        send_event: HTTPResponseBodyEvent,
+        fragments: Optional[Sequence[Part]] = None,
+    ) -> bool:
+        streaming = self.compressor.select_engine(self.initial_send_event, send_event)
+
+        if streaming:
+            self.compressor.rewrite_headers(self.initial_send_event)
+        else:
+            compressed_data = await self.compress_single_body(
+                send_event["body"], fragments
+            )
+            if self.disconnected:
+                return False
+            self.compressor.apply_single_body(
+                self.initial_send_event, send_event, compressed_data
+            )
+            if self.stored:
+                self.compressor.apply_byte_range(self.initial_send_event, send_event)
+
+        return streaming
+
+    async def send_start(self, start_event: HTTPResponseStartEvent) -> None:
+        await self.send(start_event)
+
+    async def compress_single_body(
+        self, body: bytes, fragments: Optional[Sequence[Part]] = None
+    ) -> bytes:
+        engine = self.compressor.engine
+        if self.store is None or not engine.encoding_name:
+            return await self.encode_single_body(body, fragments)
+
+        self.stored = True
+        key = self.compressor.store_key(body)
+        compressed_data = await self.store.get(key)
+        if compressed_data is None:
+            if self.disconnected:
+                # the engine is gone: its identity output would poison the key
+                return b""
+            compressed_data = await self.encode_single_body(body, fragments)
+            await self.store.put(key, compressed_data)
+        else:
+            engine.content_length = len(compressed_data)
+
+        return compressed_data
+
+    async def encode_single_body(
+        self, body: bytes, fragments: Optional[Sequence[Part]] = None
+    ) -> bytes:
+        engine = self.compressor.engine
+        self.compressor.consume(len(body))
+        if fragments is not None and engine.encoding_name in STITCHED_ENCODINGS:
+            return stitch(engine, fragments)
+        if self.parallel is not None and self.parallel.accepts(engine, body):
+            return await self.parallel.compress(engine, body)
+        if self.batcher is not None and self.batcher.accepts(engine, body):
+            return await self.batcher.compress(engine, body)
+
+        return engine.compress(body, True)
+
+    async def send_body(self, send_event: HTTPResponseBodyEvent) -> None:
+        if self.compressor.passthrough:
             await self.send(send_event)
+            return
+
+        last_chunk = not send_event.get("more_body", False)
+        self.compressor.consume(len(send_event["body"]))
+
+        # transcoding always streams, as a small chunk can inflate to any size
+        if not self.compressor.slice_size and not self.compressor.transcoding:
+            send_event["body"] = self.compressor.engine.compress(
+                send_event["body"], last_chunk
+            )
+            await self.send(send_event)
+            return
+
+        # Every slice is awaited through `send` before the next one is
+        # compressed, so the server's flow control bounds buffered output.
+        pending = None
+        async for compressed_data in self.compressor.engine.compress_stream(
+            send_event["body"], last_chunk, self.compressor.slice_size
+        ):
+            if pending is not None:
+                await self.send(
+                    {"type": "http.response.body", "body": pending, "more_body": True}
+                )
+            pending = compressed_data
+
+        if pending is not None or last_chunk:
+            send_event["body"] = pending or b""
+            await self.send(send_event)
+
+
+class TimedCompressionResponder(CompressionResponder):
+    """
+    Reports the time spent compressing, the time `http.response.start` was
+    held waiting for the first body and the byte counts. Single-body responses
+    get a `Server-Timing` header, compressed streams a log record once
+    finished.
+
+    Time is taken around whole bodies rather than inside the encoder, so
+    parallel, stitched, batched and stored bodies are accounted too; time
+    spent in the server's `send` is left out. A start decided from the headers
+    is held until the first body, so a single body can still carry the header.
+    """
+
+    def __init__(
+        self,
+        app: ASGI3Application,
+        compressor: Compressor,
+        batcher: Optional["CompressionBatcher"] = None,
+        parallel: Optional["ParallelCompressor"] = None,
+        store: Optional["BodyStore"] = None,
+        recording: Optional["Recording"] = None,
+        json_streamer: Optional[JSONStreamer] = None,
+    ) -> None:
+        super().__init__(
+            app, compressor, batcher, parallel, store, recording, json_streamer
+        )
+        self.stats = EncoderStats()
+        self.hold_started = 0.0
+        self.hold_time = 0.0
+        self.held_start: Optional[HTTPResponseStartEvent] = None
+
+    async def __call__(
+        self, scope: Scope, receive: ASGIReceiveCallable, send: ASGISendCallable
+    ) -> None:
+        await super().__call__(scope, receive, send)
+
+        if self.held_start is not None:
+            await self.send(self.held_start)
+
+    async def send_with_compression(self, send_event: ASGIHTTPSendEvent) -> None:
+        if send_event["type"] == "http.response.start":
+            self.hold_started = time.perf_counter()
+        elif send_event["type"] == "http.response.body" and (
+            self.initial_send_event or self.held_start
+        ):
+            self.hold_time = time.perf_counter() - self.hold_started
+        elif self.held_start is not None and send_event["type"] not in (
+            "http.response.body",
+            JSON_STREAM_EXTENSION,
+        ):
+            start_event, self.held_start = self.held_start, None
+            await self.send(start_event)
+
+        await super().send_with_compression(send_event)
+
+    def client_disconnected(self) -> None:
+        super().client_disconnected()
+        self.held_start = None
+
+    async def send_start(self, start_event: HTTPResponseStartEvent) -> None:
+        self.held_start = start_event
+
+    async def compress_single_body(
+        self, body: bytes, fragments: Optional[Sequence[Part]] = None
+    ) -> bytes:
+        started = time.perf_counter()
+        compressed_data = await super().compress_single_body(body, fragments)
+        self.stats.compress_time += time.perf_counter() - started
+        self.stats.bytes_in += len(body)
+        return compressed_data
+
+    async def response_init(
+        self,
+        send_event: HTTPResponseBodyEvent,
+        fragments: Optional[Sequence[Part]] = None,
+    ) -> bool:
+        streaming = await super().response_init(send_event, fragments)
+
+        if not streaming and not self.disconnected:
+            self.stats.bytes_out += len(send_event["body"])
+            self.initial_send_event["headers"] = [
+                *self.initial_send_event["headers"],
+                (b"server-timing", self.server_timing().encode("latin-1")),
+            ]
+
+        return streaming
+
+    async def send_body(self, send_event: HTTPResponseBodyEvent) -> None:
+        last_chunk = not send_event.get("more_body", False)
+        start_event, self.held_start = self.held_start, None
+
+        if start_event is not None and last_chunk and not self.compressor.transcoding:
+            # a single body after all: send it behind the timed start
+            body_events = []
+            await self.timed_send_body(send_event, body_events.append)
+            start_event["headers"] = [
+                *start_event["headers"],
+                (b"server-timing", self.server_timing().encode("latin-1")),
+            ]
+            for event in (start_event, *body_events):
+                await self.send(event)
+            return
+
+        if start_event is not None:
+            await self.send(start_event)
+        await self.timed_send_body(send_event, None)
+
+        if last_chunk and not self.compressor.passthrough:
+            import logging
+
+            logging.getLogger("compress_asgi").info(
+                "compression %s",
+                self.server_timing(),
+                extra={
+                    "encoding": self.compressor.engine.encoding_name or "identity",
+                    "compress_time": self.stats.compress_time,
+                    "hold_time": self.hold_time,
+                    "bytes_in": self.stats.bytes_in,
+                    "bytes_out": self.stats.bytes_out,
+                },
+            )
+
+    async def timed_send_body(
+        self,
+        send_event: HTTPResponseBodyEvent,
+        collect: Optional[Callable[[ASGIHTTPSendEvent], None]],
+    ) -> None:
+        """Sends the body, or passes its events to `collect`, timing the rest."""
+        server_send = self.send
+        waited = 0.0
+
+        async def timed_send(event: ASGIHTTPSendEvent) -> None:
+            nonlocal waited
+            self.stats.bytes_out += len(event.get("body", b""))
+            if collect is not None:
+                collect(event)
+                return
+            started = time.perf_counter()
+            await server_send(event)
+            waited += time.perf_counter() - started
+
+        self.stats.bytes_in += len(send_event["body"])
+        self.send = timed_send
+        started = time.perf_counter()
+        try:
+            await super().send_body(send_event)
+        finally:
+            self.send = server_send
+        self.stats.compress_time += time.perf_counter() - started - waited
+
+    def server_timing(self) -> str:
+        engine = self.compressor.engine
+        description = (
+            f"{engine.encoding_name or 'identity'} "
+            f"{self.stats.bytes_in}B>{self.stats.bytes_out}B"
+        )
+        return (
+            f'compress;dur={self.stats.compress_time * 1000:.3f};desc="{description}", '
+            f"compress-hold;dur={self.hold_time * 1000:.3f}"
+        )
@@ -0,0 +1,70 @@
+import asyncio
+import zlib
+from concurrent.futures import Executor
+from typing import Optional
+
+from .compressors import BaseEncoder
+from .deflate_tools import WINDOW_SIZE, deflate_block, frame_blocks
+
+
+class ParallelCompressor:
+    """
+    Compresses single bodies of at least `threshold` bytes as independent
+    `block_size` blocks on `executor` threads (pigz-style), stitching them into
+    one gzip or deflate stream. zlib releases the GIL while compressing, so the
+    blocks use all cores. zstd bodies are compressed in one call on an
+    `executor` thread by zstandard's own `zstd_threads` workers instead.
+    Requires an asyncio event loop.
+    """
+
+    encodings = ("gzip", "deflate", "zstd")
+
+    def __init__(
+        self,
+        threshold: int = 1 << 20,
+        block_size: int = 1 << 17,
+        executor: Optional[Executor] = None,
+        zstd_threads: int = -1,
+    ) -> None:
+        self.threshold = threshold
+        self.block_size = block_size
+        self.executor = executor
+        self.zstd_threads = zstd_threads
+
+    def accepts(self, engine: BaseEncoder, data: bytes) -> bool:
+        return engine.encoding_name in self.encodings and len(data) >= self.threshold
+
+    async def compress(self, engine: BaseEncoder, data: bytes) -> bytes:
+        loop = asyncio.get_running_loop()
+        if engine.encoding_name == "zstd":
+            compressor = engine.zstandard.ZstdCompressor(
+                level=engine.level, threads=self.zstd_threads
+            )
+            compressed_data = await loop.run_in_executor(
+                self.executor, compressor.compress, data
+            )
+            engine.content_length = len(compressed_data)
+            return compressed_data
+
+        gzip = engine.encoding_name == "gzip"
+        checksum = zlib.crc32 if gzip else zlib.adler32
+        view = memoryview(data)
+
+        blocks = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executor,
+                    deflate_block,
+                    view[start : start + self.block_size],
+                    bytes(view[max(start - WINDOW_SIZE, 0) : start]),
+                    engine.level,
+                    checksum,
+                    start + self.block_size >= len(data),
+                )
+                for start in range(0, len(data), self.block_size)
+            )
+        )
+
+        compressed_data = frame_blocks(gzip, engine.level, blocks)
+        engine.content_length = len(compressed_data)
+        return compressed_data
@@ -0,0 +1,19 @@
+from typing import Dict, Tuple
+
+from .compressors import Tier
+
+
+def load_policy(path: str) -> Dict[str, Tuple[Tier, ...]]:
+    """Reads the `tiers` of a policy file written by `compress_asgi.tuning`."""
+    import json
+
+    with open(path) as policy_file:
+        policy = json.load(policy_file)
+
+    return {
+        mimetype: tuple(
+            (largest, encoding_name, level)
+            for largest, encoding_name, level in mimetype_tiers
+        )
+        for mimetype, mimetype_tiers in policy["tiers"].items()
+    }
@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import json
+import os
+import queue
+import random
+import string
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+
+from .compressors import Scope
+from .headers_tools import Headers, ResponseHeaders
+
+BODY_MODES = ("none", "hash", "redacted")
+RATIO_SAMPLE_SIZE = 65536
+
+
+def redaction_table(rng: random.Random) -> bytes:
+    """Byte table replacing letters and digits within their own class."""
+    table = bytearray(range(256))
+    for alphabet in (string.ascii_lowercase, string.ascii_uppercase, string.digits):
+        shuffled = rng.sample(alphabet, len(alphabet))
+        for original, replacement in zip(alphabet, shuffled):
+            table[ord(original)] = ord(replacement)
+    return bytes(table)
+
+
+class TrafficRecorder:
+    """
+    Samples `sample_rate` of the responses passing through the responder and
+    appends their shape as a JSON line to `path`: status, content type and
+    length, Accept-Encoding, negotiated encoding, chunk sizes before and after
+    compression and the zlib level 1 ratio of the first 64 KiB.
+
+    `body="hash"` adds a BLAKE2 digest of the body, `body="redacted"` the body
+    itself, up to `max_body_size`, with letters and digits substituted through
+    a random per-recorder table. Substitution keeps the structure that
+    compression depends on, but is not a security boundary.
+
+    Records are serialized and appended by a writer thread, off the event
+    loop. Every record is a single append, so all workers can share one file;
+    `close` writes the records still queued.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 0.01,
+        body: str = "none",
+        max_body_size: int = 1 << 20,
+    ) -> None:
+        if body not in BODY_MODES:
+            raise ValueError(f"body must be one of {BODY_MODES}")
+
+        self.path = path
+        self.sample_rate = sample_rate
+        self.body = body
+        self.max_body_size = max_body_size
+        self.rng = random.Random()
+        self.table = redaction_table(random.SystemRandom())
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.queue: "queue.SimpleQueue[Optional[Recording]]" = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+
+    def sample(self, scope: Scope) -> Optional["Recording"]:
+        if self.rng.random() >= self.sample_rate:
+            return None
+        return Recording(self, scope)
+
+    def write(self, recording: "Recording") -> None:
+        self.queue.put(recording)
+
+    def write_records(self) -> None:
+        while True:
+            recording = self.queue.get()
+            if recording is None:
+                return
+            line = json.dumps(recording.build(), separators=(",", ":")) + "\n"
+            os.write(self.fd, line.encode())
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.writer.join()
+        os.close(self.fd)
+
+
+class Recording:
+    """The shape of one sampled response, collected from its ASGI events."""
+
+    def __init__(self, recorder: TrafficRecorder, scope: Scope) -> None:
+        self.recorder = recorder
+        self.record: Dict[str, Any] = {
+            "path": scope.get("path", "/"),
+            "accept_encoding": Headers(scope=scope).get("accept-encoding", ""),
+            "status": None,
+            "content_type": "",
+            "content_length": None,
+            "encoding": "identity",
+            "chunks": [],
+            "sent": [],
+        }
+        self.sample = bytearray()
+        self.digest = (
+            hashlib.blake2b(digest_size=16) if recorder.body == "hash" else None
+        )
+        self.body: Optional[List[bytes]] = [] if recorder.body == "redacted" else None
+        self.body_size = 0
+
+    def received(self, send_event: Dict[str, Any]) -> None:
+        """Notes an event as sent by the application."""
+        if send_event["type"] == "http.response.start":
+            response_headers = ResponseHeaders(send_event.get("headers", []))
+            self.record["status"] = send_event["status"]
+            self.record["content_type"] = response_headers.content_type.decode(
+                "latin-1"
+            )
+            self.record["content_length"] = response_headers.content_length
+        elif send_event["type"] == "http.response.body":
+            body = send_event.get("body", b"")
+            self.record["chunks"].append(len(body))
+            self.body_size += len(body)
+
+            if len(self.sample) < RATIO_SAMPLE_SIZE:
+                self.sample += body[: RATIO_SAMPLE_SIZE - len(self.sample)]
+            if self.digest is not None:
+                self.digest.update(body)
+            if self.body is not None:
+                if self.body_size > self.recorder.max_body_size:
+                    self.body = None
+                else:
+                    self.body.append(body)
+
+    def sent(self, send_event: Dict[str, Any]) -> None:
+        """Notes an event as passed on to the server."""
+        if send_event["type"] == "http.response.start":
+            for key, value in send_event.get("headers", []):
+                if key == b"content-encoding":
+                    self.record["encoding"] = value.decode("latin-1")
+        elif send_event["type"] == "http.response.body":
+            self.record["sent"].append(len(send_event.get("body", b"")))
+
+    def finish(self) -> None:
+        self.recorder.write(self)
+
+    def build(self) -> Dict[str, Any]:
+        """The finished record; the writer thread calls this."""
+        self.record["ratio"] = round(
+            (
+                len(zlib.compress(self.sample, 1)) / len(self.sample)
+                if self.sample
+                else 1.0
+            ),
+            4,
+        )
+        if self.digest is not None:
+            self.record["digest"] = self.digest.hexdigest()
+        if self.body is not None:
+            self.record["body"] = base64.b64encode(
+                b"".join(self.body).translate(self.recorder.table)
+            ).decode()
+
+        return self.record
@@ -0,0 +1,170 @@
+import abc
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Optional
+
+logger = logging.getLogger("compress_asgi")
+
+MAGIC = b"CAS1"
+# magic, index slots, absolute position of the next write
+HEADER = struct.Struct("<4sIQ")
+HEAD = struct.Struct("<Q")
+HEAD_OFFSET = 8
+# key digest, absolute position, length, CRC-32 of the body
+ENTRY = struct.Struct("<16sQII")
+
+
+class BodyStore(abc.ABC):
+    """Compressed bodies shared between workers, keyed by `Compressor.store_key`."""
+
+    @abc.abstractmethod
+    async def get(self, key: bytes) -> Optional[bytes]:
+        """The stored body, or None on a miss."""
+
+    @abc.abstractmethod
+    async def put(self, key: bytes, value: bytes) -> None:
+        """Stores `value`; stores may drop it, e.g. when too large."""
+
+
+class MmapStore(BodyStore):
+    """
+    A file of `size` bytes mapped by every worker on the host: a direct-mapped
+    index of `index_slots` entries in front of a ring buffer of bodies, so the
+    oldest bodies are evicted first. Writers serialize on `flock`; readers take
+    no lock and drop entries which were overwritten or torn by checking the
+    CRC-32 of the body. POSIX only.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 64 << 20,
+        index_slots: int = 8192,
+        max_body_size: Optional[int] = None,
+    ) -> None:
+        self.index_slots = index_slots
+        self.data_offset = HEADER.size + index_slots * ENTRY.size
+        self.data_size = size - self.data_offset
+        if self.data_size <= 0:
+            raise ValueError("store size leaves no room for bodies")
+        self.max_body_size = max_body_size or self.data_size // 8
+
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+            existing_size = os.fstat(self.fd).st_size
+            if existing_size == 0:
+                os.ftruncate(self.fd, size)
+            elif existing_size != size:
+                raise ValueError(f"{path} holds a store of {existing_size} bytes")
+
+            self.map = mmap.mmap(self.fd, size)
+            magic, existing_slots, _ = HEADER.unpack_from(self.map)
+            if magic != MAGIC:
+                HEADER.pack_into(self.map, 0, MAGIC, index_slots, 0)
+            elif existing_slots != index_slots:
+                self.map.close()
+                raise ValueError(f"{path} holds a store of {existing_slots} slots")
+
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        except BaseException:
+            # closing the descriptor also releases the lock
+            os.close(self.fd)
+            raise
+
+    def entry_offset(self, digest: bytes) -> int:
+        slot = int.from_bytes(digest[:8], "little") % self.index_slots
+        return HEADER.size + slot * ENTRY.size
+
+    async def get(self, key: bytes) -> Optional[bytes]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        entry_digest, position, length, crc = ENTRY.unpack_from(
+            self.map, self.entry_offset(digest)
+        )
+        if entry_digest != digest:
+            return None
+
+        (head,) = HEAD.unpack_from(self.map, HEAD_OFFSET)
+        if head > position + self.data_size:
+            return None
+
+        # a single copy straight out of the mapping, as ASGI bodies are bytes
+        start = self.data_offset + position % self.data_size
+        value = self.map[start : start + length]
+        return value if zlib.crc32(value) == crc else None
+
+    async def put(self, key: bytes, value: bytes) -> None:
+        if len(value) > self.max_body_size:
+            return
+
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                (position,) = HEAD.unpack_from(self.map, HEAD_OFFSET)
+                # bodies never wrap around the end of the ring
+                if position % self.data_size + len(value) > self.data_size:
+                    position += self.data_size - position % self.data_size
+
+                # the head moves first, so readers see the region as reused
+                HEAD.pack_into(self.map, HEAD_OFFSET, position + len(value))
+                start = self.data_offset + position % self.data_size
+                self.map[start : start + len(value)] = value
+                ENTRY.pack_into(
+                    self.map,
+                    self.entry_offset(digest),
+                    digest,
+                    position,
+                    len(value),
+                    zlib.crc32(value),
+                )
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        self.map.close()
+        os.close(self.fd)
+
+
+class RedisStore(BodyStore):
+    """
+    Stores bodies in a local Redis-compatible server through an asyncio client
+    such as `redis.asyncio.Redis`. Bound its memory with the server's
+    `maxmemory` and an `allkeys-lru` policy. Server errors count as misses.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        prefix: bytes = b"compress_asgi:",
+        ttl: Optional[int] = None,
+        max_body_size: int = 1 << 20,
+    ) -> None:
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_body_size = max_body_size
+
+    async def get(self, key: bytes) -> Optional[bytes]:
+        try:
+            return await self.client.get(self.prefix + key)
+        except Exception:
+            logger.warning("compressed body store unavailable", exc_info=True)
+            return None
+
+    async def put(self, key: bytes, value: bytes) -> None:
+        if len(value) > self.max_body_size:
+            return
+
+        try:
+            await self.client.set(self.prefix + key, value, ex=self.ttl)
+        except Exception:
+            logger.warning("compressed body store unavailable", exc_info=True)
@@ -0,0 +1,133 @@
+import zlib
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+
+from .compressors import BaseEncoder, load_backend
+
+DECODE_SLICE = 65536
+# zstandard cannot cap its output, so its input is fed in small pieces instead
+ZSTD_INPUT_SLICE = 1024
+
+
+class ZlibDecoder:
+    """Decodes gzip (`wbits` 31, members in sequence) or zlib (`wbits` 15)."""
+
+    def __init__(self, wbits: int) -> None:
+        self.wbits = wbits
+        self.decompressobj = zlib.decompressobj(wbits)
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        # at most DECODE_SLICE bytes of output at a time bound the memory a
+        # highly compressed chunk can take
+        while True:
+            decoded_data = self.decompressobj.decompress(data, DECODE_SLICE)
+            if decoded_data:
+                yield decoded_data
+
+            if self.decompressobj.eof and self.decompressobj.unused_data:
+                data = self.decompressobj.unused_data
+                self.decompressobj = zlib.decompressobj(self.wbits)
+                continue
+
+            data = self.decompressobj.unconsumed_tail
+            if not data and len(decoded_data) < DECODE_SLICE:
+                return
+
+
+class BrotliDecoder:
+    def __init__(self) -> None:
+        self.decompressor = load_backend("brotli").Decompressor()
+        # brotli before 1.1 cannot cap the output of a call
+        self.bounded = hasattr(self.decompressor, "can_accept_more_data")
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        if not self.bounded:
+            yield self.decompressor.process(data)
+            return
+
+        decoded_data = self.decompressor.process(data, output_buffer_limit=DECODE_SLICE)
+        while True:
+            if decoded_data:
+                yield decoded_data
+            if (
+                len(decoded_data) < DECODE_SLICE
+                and self.decompressor.can_accept_more_data()
+            ):
+                return
+            decoded_data = self.decompressor.process(
+                b"", output_buffer_limit=DECODE_SLICE
+            )
+
+
+class ZstdDecoder:
+    def __init__(self) -> None:
+        zstandard = load_backend("zstandard")
+        self.decompressobj = zstandard.ZstdDecompressor().decompressobj(
+            read_across_frames=True
+        )
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        for start in range(0, len(data), ZSTD_INPUT_SLICE):
+            decoded_data = self.decompressobj.decompress(
+                data[start : start + ZSTD_INPUT_SLICE]
+            )
+            if decoded_data:
+                yield decoded_data
+
+
+DECODERS: Dict[str, Callable[[], object]] = {
+    "gzip": lambda: ZlibDecoder(31),
+    "x-gzip": lambda: ZlibDecoder(31),
+    "deflate": lambda: ZlibDecoder(15),
+    "br": BrotliDecoder,
+    "zstd": ZstdDecoder,
+}
+DECODER_BACKENDS = {"br": "brotli", "zstd": "zstandard"}
+
+
+def get_decoder(encoding_name: str) -> Optional[Callable[[], object]]:
+    backend = DECODER_BACKENDS.get(encoding_name)
+    if backend and load_backend(backend) is None:
+        return None
+    return DECODERS.get(encoding_name)
+
+
+class TranscodingEncoder:
+    """
+    Decodes an upstream content coding chunk by chunk and feeds the result to
+    `engine`, which may be the identity. Not a `BaseEncoder` subclass, so it
+    never takes part in negotiation.
+
+    `compress_stream` yields the output of every decoded slice on its own, so
+    a small chunk which inflates to a large body never sits in memory whole.
+    """
+
+    def __init__(self, decoder, engine: BaseEncoder) -> None:
+        self.decoder = decoder
+        self.engine = engine
+        self.encoding_name = engine.encoding_name
+        self.mimetype = engine.mimetype
+        self.level = engine.level
+        self.content_length = 0
+
+    async def compress_stream(
+        self, data: bytes, last_chunk: bool = False, slice_size: int = 0
+    ) -> AsyncIterator[bytes]:
+        """
+        Decodes `data` and yields the encoder's output for every decoded slice
+        of at most `slice_size` bytes, or `DECODE_SLICE` when it is 0.
+        """
+        slice_size = slice_size or DECODE_SLICE
+        for decoded_data in self.decoder.decode(data):
+            for start in range(0, len(decoded_data), slice_size):
+                compressed_data = self.engine.compress(
+                    decoded_data[start : start + slice_size]
+                )
+                if compressed_data:
+                    self.content_length += len(compressed_data)
+                    yield compressed_data
+
+        if last_chunk:
+            compressed_data = self.engine.compress(b"", True)
+            if compressed_data:
+                self.content_length += len(compressed_data)
+                yield compressed_data
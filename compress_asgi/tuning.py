@@ -0,0 +1,178 @@
+"""
+Measures every encoder and level on a corpus of sample bodies and writes a
+policy file giving, per media type, the best ratio within a CPU budget.
+
+    python -m compress_asgi.tuning CORPUS --max-us-per-kb 20 -o policy.json
+
+CORPUS holds one directory per media type, e.g. CORPUS/application/json/*.
+Load the result with CompressionMiddleware(app, policy="policy.json").
+"""
+
+import argparse
+import json
+import pathlib
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .compressors import BaseEncoder, Tier, get_encoder
+
+Corpus = Dict[str, List[bytes]]
+# media type, encoding, level, bytes in, bytes out, best seconds
+Measurement = Tuple[str, str, int, int, int, float]
+
+CORPUS: Corpus = {}
+
+
+def read_corpus(root: str) -> Corpus:
+    corpus: Corpus = {}
+    for path in sorted(pathlib.Path(root).glob("*/*/*")):
+        if path.is_file():
+            mimetype = f"{path.parent.parent.name}/{path.parent.name}"
+            corpus.setdefault(mimetype, []).append(path.read_bytes())
+    return corpus
+
+
+def load_corpus(root: str) -> None:
+    CORPUS.update(read_corpus(root))
+
+
+def measure(mimetype: str, encoding_name: str, level: int, repeat: int) -> Measurement:
+    """Compresses every sample of `mimetype`, keeping the best of `repeat` runs."""
+    encoder = get_encoder(encoding_name)
+    samples = CORPUS[mimetype]
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        compressed_length = sum(
+            len(encoder(mimetype, level).compress(sample, True)) for sample in samples
+        )
+        best = min(best, time.perf_counter() - started)
+
+    return (
+        mimetype,
+        encoding_name,
+        level,
+        sum(map(len, samples)),
+        compressed_length,
+        best,
+    )
+
+
+def tune(
+    root: str,
+    max_us_per_kb: float,
+    repeat: int = 3,
+    executor: Optional[Executor] = None,
+) -> Dict[str, object]:
+    """
+    Measures all encoder and level combinations, in parallel on `executor`
+    (one process per core by default), and builds the policy: per media type,
+    the best ratio of every encoding within `max_us_per_kb`, ordered from the
+    best ratio, then the cheapest level of every other encoding as a fallback,
+    ordered from the cheapest.
+    """
+    corpus = read_corpus(root)
+    jobs = [
+        (mimetype, encoder.encoding_name, level, repeat)
+        for mimetype in corpus
+        for encoder in BaseEncoder.__subclasses__()
+        if encoder.available()
+        for level in encoder.levels
+    ]
+
+    if executor is None:
+        executor = ProcessPoolExecutor(initializer=load_corpus, initargs=(root,))
+        with executor:
+            measurements = list(executor.map(measure, *zip(*jobs)))
+    else:
+        load_corpus(root)
+        measurements = list(executor.map(measure, *zip(*jobs)))
+
+    results: Dict[str, Dict[str, List[Tuple[float, float, int]]]] = {}
+    for (
+        mimetype,
+        encoding_name,
+        level,
+        length,
+        compressed_length,
+        seconds,
+    ) in measurements:
+        results.setdefault(mimetype, {}).setdefault(encoding_name, []).append(
+            (compressed_length / length, seconds * 1e6 / (length / 1024), level)
+        )
+
+    tiers: Dict[str, List[Tier]] = {}
+    for mimetype, encodings in results.items():
+        choices = []
+        for encoding_name, options in encodings.items():
+            within_budget = [option for option in options if option[1] <= max_us_per_kb]
+            if within_budget:
+                ratio, cost, level = min(within_budget)
+                choices.append((False, ratio, cost, encoding_name, level))
+            else:
+                cost, ratio, level = min(
+                    (cost, ratio, level) for ratio, cost, level in options
+                )
+                choices.append((True, cost, ratio, encoding_name, level))
+
+        tiers[mimetype] = [
+            (None, encoding_name, level)
+            for _, _, _, encoding_name, level in sorted(choices)
+        ]
+
+    return {
+        "max_us_per_kb": max_us_per_kb,
+        "tiers": tiers,
+        "measurements": {
+            mimetype: {
+                encoding_name: [
+                    {
+                        "level": level,
+                        "ratio": round(ratio, 4),
+                        "us_per_kb": round(cost, 2),
+                    }
+                    for ratio, cost, level in sorted(
+                        options, key=lambda option: option[2]
+                    )
+                ]
+                for encoding_name, options in encodings.items()
+            }
+            for mimetype, encodings in results.items()
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus")
+    budget = parser.add_mutually_exclusive_group(required=True)
+    budget.add_argument("--max-us-per-kb", type=float)
+    budget.add_argument("--min-mb-per-s", type=float, help="per core")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-o", "--output", default="policy.json")
+    args = parser.parse_args(argv)
+    if args.max_us_per_kb is not None and args.max_us_per_kb < 0:
+        parser.error("--max-us-per-kb must not be negative")
+    if args.min_mb_per_s is not None and args.min_mb_per_s <= 0:
+        parser.error("--min-mb-per-s must be positive")
+
+    if args.max_us_per_kb is not None:
+        max_us_per_kb = args.max_us_per_kb
+    else:
+        max_us_per_kb = 1e6 / (args.min_mb_per_s * 1024)
+    policy = tune(args.corpus, max_us_per_kb, args.repeat)
+
+    with open(args.output, "w") as output:
+        json.dump(policy, output, indent=2)
+
+    for mimetype, mimetype_tiers in policy["tiers"].items():
+        print(
+            mimetype,
+            " ".join(f"{encoding}:{level}" for _, encoding, level in mimetype_tiers),
+        )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -20,5 +20,6 @@ setuptools.setup(
     python_requires=">=3.7",
     extras_require={
         "brotli": ["brotli>=1.0.9,<2"],
+        "zstd": ["zstandard>=0.18"],
     },
 )
@@ -9,7 +9,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 @pytest.fixture(params=(True, False), autouse=True, ids=("NoDeps", "FullDeps"))
 def hide_optional_dependencies(request, monkeypatch):
-    OPTIONAL_DEPS = ("starlette", "asgiref", "brotli")
+    OPTIONAL_DEPS = ("starlette", "asgiref", "brotli", "zstandard", "orjson")
     if request.param:
 
         import_orig = builtins.__import__
@@ -34,3 +34,50 @@ def hide_optional_dependencies(request, monkeypatch):
         monkeypatch.delitem(sys.modules, m)
 
     return request.param
+
+
+def send_request(
+    middleware,
+    response,
+    headers=((b"accept-encoding", b"gzip"),),
+    path="/",
+    query_string=b"",
+    receive_type="http.request",
+):
+    """
+    Runs one GET request through `middleware(app)` and returns the events it
+    sent. `app` sends the `response` events, or is `response` if callable;
+    `receive` returns `receive_type` events, e.g. "http.disconnect".
+    """
+    import asyncio
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": query_string,
+        "headers": list(headers),
+    }
+    sent = []
+
+    async def receive():
+        if receive_type != "http.request":
+            return {"type": receive_type}
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(event):
+        sent.append(event)
+
+    async def app(scope, receive, send):
+        for event in response:
+            await send(event)
+
+    asyncio.run(
+        middleware(response if callable(response) else app)(scope, receive, send)
+    )
+    return sent
+
+
+@pytest.fixture
+def run_asgi():
+    return send_request
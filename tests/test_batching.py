@@ -0,0 +1,108 @@
+import asyncio
+import zlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.testclient import TestClient
+
+
+@pytest.mark.parametrize(
+    ("path", "size"), (("/small", 1000), ("/large", 100000), ("/stream", 1000))
+)
+def test_batched_responses(path: str, size: int):
+    from compress_asgi import CompressionBatcher, CompressionMiddleware
+
+    TEST_RESPONSE = "1" * size
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware, batcher=CompressionBatcher())
+    app.add_route("/small", lambda request: PlainTextResponse(TEST_RESPONSE))
+    app.add_route("/large", lambda request: PlainTextResponse(TEST_RESPONSE))
+    app.add_route(
+        "/stream",
+        lambda request: StreamingResponse(
+            iter((TEST_RESPONSE,)), media_type="text/plain"
+        ),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(path, headers={"accept-encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.text == TEST_RESPONSE
+    assert response.headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("max_batch", (1, 4))
+def test_batch_flushes_when_full(max_batch: int):
+    from compress_asgi import CompressionBatcher
+    from compress_asgi.compressors import DeflateEncoder
+
+    batcher = CompressionBatcher(window=60, max_batch=max_batch)
+    bodies = [str(i).encode() * 100 for i in range(8)]
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(
+                *(
+                    batcher.compress(DeflateEncoder("text/plain"), body)
+                    for body in bodies
+                )
+            ),
+            timeout=5,
+        )
+
+    assert [zlib.decompress(data) for data in asyncio.run(run())] == bodies
+
+
+def test_batch_error_and_cancellation():
+    from compress_asgi import CompressionBatcher
+    from compress_asgi.compressors import DeflateEncoder
+
+    class FailingEncoder(DeflateEncoder):
+        def compress(self, data: bytes, last_chunk: bool = False) -> bytes:
+            raise RuntimeError("compression failed")
+
+    batcher = CompressionBatcher()
+
+    async def run():
+        cancelled = asyncio.ensure_future(
+            batcher.compress(DeflateEncoder("text/plain"), b"1")
+        )
+        failing = asyncio.ensure_future(
+            batcher.compress(FailingEncoder("text/plain"), b"1")
+        )
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        with pytest.raises(RuntimeError):
+            await failing
+
+    asyncio.run(run())
+
+
+def test_batches_are_per_thread():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from compress_asgi import CompressionBatcher
+    from compress_asgi.compressors import DeflateEncoder
+
+    batcher = CompressionBatcher(window=0.01)
+
+    def run_loop(seed: int):
+        bodies = [str(seed * 100 + i).encode() * 100 for i in range(16)]
+
+        async def run():
+            return await asyncio.gather(
+                *(
+                    batcher.compress(DeflateEncoder("text/plain"), body)
+                    for body in bodies
+                )
+            )
+
+        return [zlib.decompress(data) for data in asyncio.run(run())] == bodies
+
+    with ThreadPoolExecutor(4) as pool:
+        assert all(pool.map(run_loop, range(8)))
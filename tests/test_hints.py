@@ -0,0 +1,104 @@
+import pytest
+
+
+def build_compressor(headers, level=None, **hints_kwargs):
+    from compress_asgi import NetworkHints
+    from compress_asgi.compressors import Compressor
+
+    scope = {"type": "http", "path": "/", "headers": headers}
+    return Compressor(
+        500, {"text/plain"}, scope, level=level, hints=NetworkHints(**hints_kwargs)
+    )
+
+
+@pytest.mark.parametrize(
+    ("hint_headers", "level"),
+    (
+        ([(b"save-data", b"on")], "best"),
+        ([(b"ect", b"2g"), (b"downlink", b"20")], "best"),
+        ([(b"ect", b"4g"), (b"downlink", b"0.4")], "best"),
+        ([(b"ect", b"4g"), (b"downlink", b"25")], "fastest"),
+        ([(b"save-data", b"off"), (b"downlink", b"5")], None),
+        ([(b"downlink", b"fast")], None),
+        ([], None),
+    ),
+)
+def test_hints_pick_level(hint_headers, level):
+    compressor = build_compressor([(b"accept-encoding", b"gzip"), *hint_headers])
+
+    assert compressor.request_engine_cls.encoding_name == "gzip"
+    assert compressor.level == level
+
+
+def test_slow_clients_prefer_slow_encoding(hide_optional_dependencies):
+    compressor = build_compressor(
+        [(b"accept-encoding", b"gzip, br"), (b"save-data", b"on")],
+        slow_encoding="br",
+    )
+
+    expected = "gzip" if hide_optional_dependencies else "br"
+    assert compressor.request_engine_cls.encoding_name == expected
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    ((b"gzip, deflate", "deflate"), (b"gzip, deflate;q=0", "gzip")),
+)
+def test_slow_encoding_must_be_acceptable(accept_encoding, expected):
+    compressor = build_compressor(
+        [(b"accept-encoding", accept_encoding), (b"save-data", b"on")],
+        slow_encoding="deflate",
+    )
+
+    assert compressor.request_engine_cls.encoding_name == expected
+
+
+def test_hints_respect_explicit_level_and_identity_clients():
+    overridden = build_compressor(
+        [(b"accept-encoding", b"deflate"), (b"save-data", b"on")], level=1
+    )
+    identity = build_compressor([(b"save-data", b"on")])
+
+    assert (overridden.request_engine_cls.encoding_name, overridden.level) == (
+        "deflate",
+        1,
+    )
+    assert (identity.request_engine_cls, identity.level) == (None, None)
+
+
+def test_hint_parsing_is_memoized():
+    from compress_asgi import NetworkHints
+
+    hints = NetworkHints()
+    scope = {"headers": [(b"ect", b"3g")]}
+
+    assert hints.profile(scope) == hints.profile(scope) == ("br", "best")
+    assert hints.profile({"headers": []}) is None
+    assert (hints.classify.cache_info().hits, hints.classify.cache_info().misses) == (
+        1,
+        1,
+    )
+
+
+def test_hinted_response_varies_on_hints(run_asgi):
+    from compress_asgi import CompressionMiddleware, NetworkHints
+
+    sent = run_asgi(
+        lambda app: CompressionMiddleware(app, hints=NetworkHints()),
+        (
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", b"2000"),
+                ],
+            },
+            {"type": "http.response.body", "body": b"1" * 2000},
+        ),
+        headers=[(b"accept-encoding", b"gzip"), (b"save-data", b"on")],
+    )
+
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"accept-encoding, save-data, ect, downlink"
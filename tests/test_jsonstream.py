@@ -0,0 +1,85 @@
+import gzip
+import json
+
+import pytest
+
+ITEMS = [
+    {"id": index, "name": f"item {index}", "tags": ["a", "b"]} for index in range(3000)
+]
+
+
+@pytest.fixture
+def run_app(run_asgi):
+    def run(items, accept_encoding=b"gzip", content_type=b"application/json", **kwargs):
+        from compress_asgi import CompressionMiddleware, JSONStreamer, send_json_items
+
+        async def app(scope, receive, send):
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", content_type)],
+                }
+            )
+            await send_json_items(scope, send, iter(items))
+
+        sent = run_asgi(
+            lambda app: CompressionMiddleware(
+                app, json_streamer=JSONStreamer(slice_size=16384, **kwargs)
+            ),
+            app,
+            headers=[(b"accept-encoding", accept_encoding)],
+        )
+
+        bodies = [event["body"] for event in sent[1:]]
+        return dict(sent[0]["headers"]), bodies
+
+    return run
+
+
+@pytest.mark.parametrize("threaded", (False, True))
+def test_json_items_are_compressed_slice_by_slice(threaded, run_app):
+    headers, bodies = run_app(ITEMS, threaded=threaded)
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert len(bodies) > 5
+    assert json.loads(gzip.decompress(b"".join(bodies))) == ITEMS
+
+
+def test_small_json_items_are_a_single_body(run_app):
+    headers, bodies = run_app(ITEMS[:100])
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"content-length"] == str(len(bodies[0])).encode()
+    assert json.loads(gzip.decompress(bodies[0])) == ITEMS[:100]
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "content_type"),
+    ((b"identity", b"application/json"), (b"gzip", b"application/octet-stream")),
+)
+def test_uncompressed_json_items(accept_encoding, content_type, run_app):
+    headers, bodies = run_app(ITEMS, accept_encoding, content_type, threaded=True)
+
+    assert b"content-encoding" not in headers
+    assert len(bodies) > 1
+    assert json.loads(b"".join(bodies)) == ITEMS
+
+
+def test_empty_json_items(run_app):
+    headers, bodies = run_app([], b"identity")
+
+    assert bodies == [b"[]"]
+
+
+def test_serializers(hide_optional_dependencies):
+    from compress_asgi.jsonstream import get_dumps, json_dumps
+
+    def dumps(obj):
+        return b"custom"
+
+    assert get_dumps(dumps) is dumps
+    assert get_dumps("json") is json_dumps
+    assert (get_dumps("orjson") is json_dumps) == hide_optional_dependencies
+    assert get_dumps("orjson")({"a": [1, 2]}) == b'{"a":[1,2]}'
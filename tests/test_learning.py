@@ -0,0 +1,84 @@
+import os
+import types
+
+import pytest
+
+TEXT = b"compressible text " * 200
+
+
+@pytest.fixture
+def run_app(run_asgi):
+    def run(tracker, path: str, body: bytes, route=None):
+        from compress_asgi import CompressionMiddleware
+
+        async def app(scope, receive, send):
+            if route is not None:
+                scope["route"] = types.SimpleNamespace(path=route)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+
+        sent = run_asgi(
+            lambda app: CompressionMiddleware(app, tracker=tracker), app, path=path
+        )
+        return dict(sent[0]["headers"]).get(b"content-encoding")
+
+    return run
+
+
+def test_incompressible_route_is_skipped_and_reprobed(run_app):
+    from compress_asgi import CompressibilityTracker
+
+    tracker = CompressibilityTracker(min_samples=3, reprobe_every=4)
+
+    for _ in range(12):
+        run_app(tracker, "/blobs/1/raw", os.urandom(4000))
+    assert run_app(tracker, "/text", TEXT) == b"gzip"
+
+    # three responses to learn, then one compressed re-probe in every four
+    blobs = tracker.routes[("/blobs/1", "application/json")]
+    assert (blobs.samples, blobs.skipped) == (5, 9)
+
+    table = tracker.table()
+    assert [(row["route"], row["samples"], row["skipping"]) for row in table] == [
+        ("/blobs/1", 5, True),
+        ("/text", 1, False),
+    ]
+    assert table[0]["ratio"] > 1 > table[1]["ratio"]
+    assert table[0]["ns_per_byte"] > 0
+
+
+def test_reprobe_clears_skipping_once_compressible(run_app):
+    from compress_asgi import CompressibilityTracker
+
+    tracker = CompressibilityTracker(alpha=1.0, min_samples=1, reprobe_every=2)
+
+    run_app(tracker, "/feed", os.urandom(4000))
+    assert run_app(tracker, "/feed", TEXT) is None
+    assert run_app(tracker, "/feed", TEXT) == b"gzip"
+    assert run_app(tracker, "/feed", TEXT) == b"gzip"
+    assert tracker.table()[0]["skipping"] is False
+
+
+def test_route_template_and_table_bounds(run_app):
+    from compress_asgi import CompressibilityTracker
+
+    tracker = CompressibilityTracker(max_routes=1)
+
+    run_app(tracker, "/items/1", TEXT, route="/items/{id}")
+    run_app(tracker, "/items/2", TEXT, route="/items/{id}")
+    run_app(tracker, "/other", TEXT)
+
+    assert list(tracker.routes) == [("/items/{id}", "application/json")]
+    assert tracker.routes[("/items/{id}", "application/json")].samples == 2
+
+    tracker.forget("/items/{id}")
+    assert tracker.table() == []
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 from starlette.applications import Starlette
 from starlette.responses import PlainTextResponse, Response, StreamingResponse
@@ -190,12 +192,1189 @@ def test_multiple_same_response_headers():
         TEST_PATH,
         lambda request: PlainTextResponse(
             TEST_RESPONSE,
-            headers=MultiDictLike("content-encoding", "gzip", "br", None, "gzip"),
+            headers=MultiDictLike("x-served-by", "a", "b", None, "a"),
         ),
     )
 
     with TestClient(app) as client:
-        response = client.get(TEST_PATH)
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
 
     assert response.status_code == 200
     assert response.text == TEST_RESPONSE
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers.get_list("x-served-by") == ["a", "b", "None", "a"]
+
+
+def test_unrelated_response_headers_preserved():
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware)
+    app.add_route(
+        TEST_PATH,
+        lambda request: PlainTextResponse(
+            TEST_RESPONSE, headers={"x-custom": "value", "cache-control": "no-cache"}
+        ),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.text == TEST_RESPONSE
+    assert response.headers["x-custom"] == "value"
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.headers["content-type"] == "text/plain; charset=utf-8"
+    assert response.headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.parametrize(
+    ("path", "encoding"),
+    (
+        ("/download/archive", None),
+        ("/download", None),
+        ("/download-page", "gzip"),
+        ("/download/fast", "gzip"),
+        ("/best", "gzip"),
+        ("/", "gzip"),
+    ),
+)
+def test_path_overrides(path: str, encoding: str | None):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+
+    app = Starlette()
+
+    app.add_middleware(
+        CompressionMiddleware,
+        path_overrides={"/download": False, "/download/fast": "fastest", "/best": 9},
+    )
+    app.add_route(path, lambda request: PlainTextResponse(TEST_RESPONSE))
+
+    with TestClient(app) as client:
+        response = client.get(path, headers={"accept-encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.text == TEST_RESPONSE
+    assert response.headers.get("content-encoding") == encoding
+
+
+@pytest.mark.parametrize(("override", "encoding"), ((False, None), ("best", "gzip")))
+def test_scope_state_override(override, encoding: str | None):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    def endpoint(request):
+        request.state.compression = override
+        return PlainTextResponse(TEST_RESPONSE)
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware)
+    app.add_route(TEST_PATH, endpoint)
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.text == TEST_RESPONSE
+    assert response.headers.get("content-encoding") == encoding
+
+
+def test_scope_state_override_from_outer_middleware():
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+    app.add_middleware(CompressionMiddleware)
+    app.add_route(TEST_PATH, lambda request: PlainTextResponse(TEST_RESPONSE))
+
+    async def outer(scope, receive, send):
+        scope.setdefault("state", {})["compression"] = False
+        await app(scope, receive, send)
+
+    with TestClient(outer) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.text == TEST_RESPONSE
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.parametrize("level", (11, -3))
+def test_out_of_range_level_is_clamped(level, run_asgi):
+    import gzip
+
+    from compress_asgi import CompressionMiddleware
+    from compress_asgi.compressors import GzipEncoder
+
+    TEST_BODY = b"1" * 2000
+    events = [
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain"),
+                (b"content-length", b"2000"),
+            ],
+        },
+        {"type": "http.response.body", "body": TEST_BODY},
+    ]
+
+    start, body = run_asgi(
+        lambda inner: CompressionMiddleware(inner, path_overrides={"/": level}),
+        events,
+    )
+
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    assert gzip.decompress(body["body"]) == TEST_BODY
+    assert GzipEncoder.resolve_level(level) in (1, 9)
+    assert GzipEncoder.resolve_level(True) == GzipEncoder.default_level
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    (
+        {"path_overrides": {"/": True}},
+        {"tiers": {"*": ((None, "gzip", False),)}},
+        {"first_flight": (1024, "fast")},
+    ),
+)
+def test_invalid_levels_are_rejected(kwargs):
+    from compress_asgi import CompressionMiddleware
+
+    with pytest.raises(ValueError):
+        CompressionMiddleware(None, **kwargs)
+
+
+def test_incompressible_body_sent_unencoded():
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = os.urandom(2000)
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware)
+    app.add_route(
+        TEST_PATH,
+        lambda request: Response(TEST_RESPONSE, media_type="application/json"),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.content == TEST_RESPONSE
+    assert "content-encoding" not in response.headers
+    assert int(response.headers["content-length"]) == len(TEST_RESPONSE)
+
+
+@pytest.mark.parametrize(("compressible", "encoding"), ((False, None), (True, "gzip")))
+def test_entropy_probe(compressible: bool, encoding: str | None):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_CHUNK = b"1" * 1000 if compressible else os.urandom(1000)
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    def responseGenerator():
+        for _ in range(4):
+            yield TEST_CHUNK
+
+    app.add_middleware(CompressionMiddleware, probe_size=4096)
+    app.add_route(
+        TEST_PATH,
+        lambda request: StreamingResponse(
+            responseGenerator(), media_type="application/json"
+        ),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.content == TEST_CHUNK * 4
+    assert response.headers.get("content-encoding") == encoding
+
+
+@pytest.mark.parametrize("encoding", ("deflate", "gzip", "br"))
+@pytest.mark.parametrize("more_body", (False, True))
+def test_sliced_streaming(
+    encoding: str, more_body: bool, hide_optional_dependencies, run_asgi
+):
+    import zlib
+
+    from compress_asgi import CompressionMiddleware
+
+    if encoding == "br" and hide_optional_dependencies:
+        pytest.skip("brotli package unavailable")
+
+    TEST_BODY = os.urandom(65536)
+    SLICE_SIZE = 4096
+
+    body_events = [{"type": "http.response.body", "body": TEST_BODY}]
+    if more_body:
+        body_events = [
+            {"type": "http.response.body", "body": TEST_BODY, "more_body": True},
+            {"type": "http.response.body", "body": b""},
+        ]
+
+    sent = run_asgi(
+        lambda app: CompressionMiddleware(app, stream_slice_size=SLICE_SIZE),
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", str(len(TEST_BODY)).encode()),
+                ],
+            },
+            *body_events,
+        ],
+        headers=[(b"accept-encoding", encoding.encode())],
+    )
+
+    start, *bodies = sent
+    headers = dict(start["headers"])
+    assert headers[b"content-encoding"] == encoding.encode()
+    assert b"content-length" not in headers
+    # brotli keeps up to a window of input buffered before emitting output
+    assert len(bodies) > 1 or encoding == "br"
+    assert all(event["more_body"] for event in bodies[:-1])
+    assert not bodies[-1].get("more_body", False)
+
+    compressed = b"".join(event["body"] for event in bodies)
+    if encoding == "br":
+        import brotli
+
+        assert brotli.decompress(compressed) == TEST_BODY
+    else:
+        assert zlib.decompress(compressed, 47) == TEST_BODY
+
+
+def test_other_send_events_forwarded(run_asgi):
+    from compress_asgi import CompressionMiddleware
+
+    sent = run_asgi(
+        CompressionMiddleware,
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+                "trailers": True,
+            },
+            {"type": "http.response.body", "body": b"1" * 1000},
+            {"type": "http.response.trailers", "headers": [], "more_trailers": False},
+        ],
+    )
+
+    assert [event["type"] for event in sent] == [
+        "http.response.start",
+        "http.response.body",
+        "http.response.trailers",
+    ]
+
+
+def test_import_is_lazy():
+    import subprocess
+    import sys
+
+    HEAVY_MODULES = (
+        "asyncio",
+        "brotli",
+        "concurrent.futures",
+        "gzip",
+        "hashlib",
+        "ipaddress",
+        "json",
+        "logging",
+        "starlette",
+    )
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; loaded = set(sys.modules); import compress_asgi;"
+            f"print(*(m for m in {HEAVY_MODULES!r} if m in {{*sys.modules}} - loaded))",
+        ],
+        capture_output=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(__file__)),
+        text=True,
+    )
+
+    assert result.stdout.split() == []
+
+
+def test_unknown_attribute():
+    import compress_asgi
+
+    with pytest.raises(AttributeError):
+        compress_asgi.UnknownName
+
+
+def test_lifespan_prewarm(hide_optional_dependencies):
+    from compress_asgi import CompressionMiddleware
+    from compress_asgi.compressors import BACKENDS
+
+    app = Starlette()
+    app.add_middleware(CompressionMiddleware, prewarm=("gzip", "br"))
+
+    assert "gzip" not in BACKENDS
+
+    with TestClient(app):
+        assert BACKENDS["gzip"] is not None
+        assert (BACKENDS["brotli"] is None) == hide_optional_dependencies
+
+
+@pytest.mark.parametrize(
+    ("status_code", "headers"),
+    (
+        (206, {"content-range": "bytes 0-1999/10000"}),
+        (200, {"content-range": "bytes 0-1999/2000"}),
+    ),
+)
+def test_partial_content_untouched(status_code: int, headers: dict):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware)
+    app.add_route(
+        TEST_PATH,
+        lambda request: PlainTextResponse(
+            TEST_RESPONSE, status_code=status_code, headers=headers
+        ),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.status_code == status_code
+    assert response.text == TEST_RESPONSE
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-range"] == headers["content-range"]
+
+
+@pytest.mark.parametrize("strip_accept_ranges", (False, True))
+def test_strip_accept_ranges(strip_accept_ranges: bool):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware, strip_accept_ranges=strip_accept_ranges)
+    app.add_route(
+        TEST_PATH,
+        lambda request: PlainTextResponse(
+            TEST_RESPONSE, headers={"accept-ranges": "bytes"}
+        ),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.text == TEST_RESPONSE
+    assert response.headers["content-encoding"] == "gzip"
+    assert ("accept-ranges" in response.headers) != strip_accept_ranges
+
+
+def test_server_timing_header():
+    from compress_asgi import CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware, server_timing=True)
+    app.add_route(TEST_PATH, lambda request: PlainTextResponse(TEST_RESPONSE))
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.text == TEST_RESPONSE
+    compress, hold = response.headers["server-timing"].split(", ")
+    assert compress.startswith("compress;dur=")
+    assert f'desc="gzip 2000B>{response.headers["content-length"]}B"' in compress
+    assert hold.startswith("compress-hold;dur=")
+
+
+def test_server_timing_streaming_log(caplog):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(CompressionMiddleware, server_timing=True)
+    app.add_route(
+        TEST_PATH,
+        lambda request: StreamingResponse(
+            iter(("1" * 1000, "1" * 1000)), media_type="text/plain"
+        ),
+    )
+
+    with caplog.at_level("INFO", logger="compress_asgi"), TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip"})
+
+    assert response.text == "1" * 2000
+    assert "server-timing" not in response.headers
+    (record,) = caplog.records
+    assert record.encoding == "gzip"
+    assert record.bytes_in == 2000
+    assert 0 < record.bytes_out < 2000
+
+
+def test_server_timing_header_decided(run_asgi):
+    import zlib
+
+    from compress_asgi import CompressionMiddleware
+
+    TEST_BODY = b"compressible text " * 250
+
+    sent = run_asgi(
+        lambda app: CompressionMiddleware(
+            app, server_timing=True, stream_slice_size=1024
+        ),
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", str(len(TEST_BODY)).encode()),
+                ],
+            },
+            {"type": "http.response.body", "body": TEST_BODY},
+        ],
+    )
+
+    # the start was decided from its headers, then held for the timing
+    body = b"".join(event["body"] for event in sent[1:])
+    assert zlib.decompress(body, 31) == TEST_BODY
+    compress, _ = dict(sent[0]["headers"])[b"server-timing"].decode().split(", ")
+    assert f'desc="gzip {len(TEST_BODY)}B>{len(body)}B"' in compress
+
+
+def test_server_timing_passthrough_not_logged(caplog, run_asgi):
+    from compress_asgi import CompressionMiddleware
+
+    with caplog.at_level("INFO", logger="compress_asgi"):
+        sent = run_asgi(
+            lambda app: CompressionMiddleware(app, server_timing=True),
+            [
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(b"content-type", b"image/png")],
+                },
+                {"type": "http.response.body", "body": b"1" * 2000, "more_body": True},
+                {"type": "http.response.body", "body": b"1" * 2000},
+            ],
+        )
+
+    assert [event.get("body") for event in sent[1:]] == [b"1" * 2000] * 2
+    assert b"server-timing" not in dict(sent[0]["headers"])
+    assert caplog.records == []
+
+
+@pytest.mark.parametrize(
+    "events",
+    (
+        [],
+        [{"type": "http.response.trailers", "headers": [], "more_trailers": False}],
+    ),
+)
+def test_server_timing_held_start_flushed(events, run_asgi):
+    from compress_asgi import CompressionMiddleware
+
+    start_event = {
+        "type": "http.response.start",
+        "status": 204,
+        "headers": [(b"content-length", b"0")],
+    }
+    sent = run_asgi(
+        lambda app: CompressionMiddleware(app, server_timing=True),
+        [start_event, *events],
+    )
+
+    assert sent == [start_event, *events]
+
+
+@pytest.mark.parametrize(
+    ("size", "accept_encoding", "encoding"),
+    (
+        (1000, "gzip, br, zstd", "gzip"),
+        (100000, "gzip, br, zstd", "br"),
+        (100000, "gzip, zstd", "gzip"),
+        (100000, "gzip, br;q=0, zstd", "gzip"),
+        (3000000, "gzip, br, zstd", "zstd"),
+        (3000000, "deflate", "deflate"),
+    ),
+)
+def test_size_tiers(size, accept_encoding, encoding, hide_optional_dependencies):
+    from compress_asgi import CompressionMiddleware
+
+    if encoding in ("br", "zstd") and hide_optional_dependencies:
+        encoding = "gzip" if "gzip" in accept_encoding else encoding
+
+    TEST_RESPONSE = "1" * size
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(
+        CompressionMiddleware,
+        tiers={
+            "text/*": (
+                (4096, "gzip", 4),
+                (1 << 20, "br", 5),
+                (1 << 20, "gzip", 6),
+                (None, "zstd", 3),
+            ),
+        },
+    )
+    app.add_route(TEST_PATH, lambda request: PlainTextResponse(TEST_RESPONSE))
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": accept_encoding})
+
+    assert response.text == TEST_RESPONSE
+    assert response.headers["content-encoding"] == encoding
+
+
+@pytest.mark.parametrize("mime", ("application/json", "text/html"))
+def test_tiers_by_mediatype(mime):
+    from compress_asgi import CompressionMiddleware
+
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(
+        CompressionMiddleware,
+        tiers={"application/json": ((None, "deflate", "best"),), "*": ()},
+    )
+    app.add_route(
+        TEST_PATH,
+        lambda request: StreamingResponse(iter(("1" * 1000,) * 3), media_type=mime),
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": "gzip, deflate"})
+
+    assert response.text == "1" * 3000
+    assert response.headers["content-encoding"] == (
+        "deflate" if mime == "application/json" else "gzip"
+    )
+
+
+@pytest.mark.parametrize("more_body", (False, True))
+def test_zstd_encoding(more_body, hide_optional_dependencies, run_asgi):
+    from compress_asgi import CompressionMiddleware
+
+    if hide_optional_dependencies:
+        pytest.skip("zstandard package unavailable")
+
+    import zstandard
+
+    TEST_BODY = b"1" * 2000
+    body_events = [{"type": "http.response.body", "body": TEST_BODY}]
+    if more_body:
+        body_events = [
+            {"type": "http.response.body", "body": TEST_BODY, "more_body": True},
+            {"type": "http.response.body", "body": b""},
+        ]
+
+    _, *bodies = run_asgi(
+        CompressionMiddleware,
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", b"2000"),
+                ],
+            },
+            *body_events,
+        ],
+        headers=[(b"accept-encoding", b"zstd")],
+    )
+
+    compressed = b"".join(event["body"] for event in bodies)
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == (
+        TEST_BODY
+    )
+
+
+@pytest.mark.parametrize(
+    ("client", "headers", "encoding"),
+    (
+        ("10.1.2.3", {}, None),
+        ("192.168.0.5", {}, "gzip"),
+        ("unix-socket", {}, "gzip"),
+        ("192.168.0.5", {"user-agent": "python-requests/2.31"}, None),
+        ("192.168.0.5", {"user-agent": "Mozilla/5.0"}, "gzip"),
+        ("192.168.0.5", {"x-internal": "1"}, None),
+        ("192.168.0.5", {"x-internal": "0"}, "gzip"),
+        ("192.168.0.5", {"x-fast-link": "yes"}, "gzip"),
+        ("192.168.0.5", {"x-fast-link": "yes", "user-agent": "curl/8"}, "gzip"),
+    ),
+)
+def test_client_rules(client, headers, encoding):
+    from compress_asgi import ClientRule, CompressionMiddleware
+
+    TEST_RESPONSE = "1" * 2000
+    TEST_PATH = "/"
+
+    app = Starlette()
+    app.add_route(TEST_PATH, lambda request: PlainTextResponse(TEST_RESPONSE))
+
+    middleware = CompressionMiddleware(
+        app,
+        client_rules=(
+            ClientRule(networks=("10.0.0.0/8", "fd00::/8")),
+            ClientRule(user_agent=r"^python-requests/"),
+            ClientRule(header="X-Internal", header_value="1"),
+            ClientRule("fastest", header="x-fast-link", user_agent="curl"),
+        ),
+    )
+
+    def rewrite_client(app):
+        async def wrapper(scope, receive, send):
+            scope["client"] = (client, 1234)
+            await app(scope, receive, send)
+
+        return wrapper
+
+    with TestClient(rewrite_client(middleware)) as client_session:
+        response = client_session.get(
+            TEST_PATH, headers={"accept-encoding": "gzip", **headers}
+        )
+
+    assert response.text == TEST_RESPONSE
+    assert response.headers.get("content-encoding") == encoding
+
+
+def test_client_rule_forces_level():
+    from compress_asgi import ClientRule, CompressionMiddleware
+
+    middleware = CompressionMiddleware(
+        None, client_rules=(ClientRule("fastest", networks=("fd00::/8",)),)
+    )
+
+    assert middleware.resolve_override({"client": ("fd00::1", 1), "headers": []}) == (
+        "fastest"
+    )
+    assert middleware.resolve_override({"client": ("::1", 1), "headers": []}) is None
+
+
+@pytest.mark.parametrize(
+    "criteria", ({}, {"networks": ()}, {"user_agent": ""}, {"header_value": "1"})
+)
+def test_client_rule_needs_a_criterion(criteria):
+    from compress_asgi import ClientRule
+
+    # a rule without criteria would match every request
+    with pytest.raises(ValueError):
+        ClientRule("fastest", **criteria)
+
+
+def test_limiter_falls_back_over_stream_limit(run_asgi):
+    import gzip
+
+    from compress_asgi import CompressionLimiter, CompressionMiddleware
+
+    TEST_BODY = b"1" * 2000
+    events = lambda: [  # noqa: E731
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain"),
+                (b"content-length", b"2000"),
+            ],
+        },
+        {"type": "http.response.body", "body": TEST_BODY},
+    ]
+
+    limiter = CompressionLimiter(max_streams=1)
+    app = lambda inner: CompressionMiddleware(inner, limiter=limiter)  # noqa: E731
+
+    assert limiter.acquire() is None
+    start, body = run_asgi(app, events())
+    assert (b"content-encoding", b"gzip") not in start["headers"]
+    assert body["body"] == TEST_BODY
+
+    limiter.release()
+    start, body = run_asgi(app, events())
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    assert gzip.decompress(body["body"]) == TEST_BODY
+    assert limiter.counters() == {
+        "streams": 0,
+        "compressed": 2,
+        "stream_fallbacks": 1,
+        "rate_fallbacks": 0,
+    }
+
+
+def test_limiter_falls_back_over_byte_rate(monkeypatch, run_asgi):
+    from compress_asgi import CompressionLimiter, CompressionMiddleware, limiter
+
+    window = 0
+    monkeypatch.setattr(limiter, "current_window", lambda: window)
+
+    TEST_BODY = b"1" * 2000
+    events = lambda: [  # noqa: E731
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain")],
+        },
+        {"type": "http.response.body", "body": TEST_BODY, "more_body": True},
+        {"type": "http.response.body", "body": TEST_BODY},
+    ]
+
+    rate_limiter = CompressionLimiter(max_bytes_per_second=3000)
+    app = lambda inner: CompressionMiddleware(inner, limiter=rate_limiter)  # noqa: E731
+
+    assert (b"content-encoding", b"gzip") in run_asgi(app, events())[0]["headers"]
+    assert rate_limiter.window_bytes == 4000
+    assert (b"content-encoding", b"gzip") not in run_asgi(app, events())[0]["headers"]
+
+    window = 1
+    assert (b"content-encoding", b"gzip") in run_asgi(app, events())[0]["headers"]
+    assert rate_limiter.counters()["rate_fallbacks"] == 1
+    assert rate_limiter.streams == 0
+
+
+def test_limiter_fallback_level(run_asgi):
+    import gzip
+
+    from compress_asgi import CompressionLimiter, CompressionMiddleware
+
+    TEST_BODY = b"1" * 2000
+    events = lambda: [  # noqa: E731
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain"),
+                (b"content-length", b"2000"),
+            ],
+        },
+        {"type": "http.response.body", "body": TEST_BODY},
+    ]
+
+    limiter = CompressionLimiter(max_streams=0, fallback="fastest")
+    start, body = run_asgi(
+        lambda inner: CompressionMiddleware(inner, limiter=limiter), events()
+    )
+
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    # the XFL byte of the gzip header flags the fastest level
+    assert body["body"][8] == 4
+    assert gzip.decompress(body["body"]) == TEST_BODY
+    assert limiter.streams == 0
+
+
+@pytest.mark.parametrize("encoding", ("gzip", "deflate", "br"))
+@pytest.mark.parametrize("ends_on_fragment", (False, True))
+def test_fragments_are_stitched(
+    encoding: str, ends_on_fragment: bool, hide_optional_dependencies, run_asgi
+):
+    import gzip
+    import zlib
+
+    from compress_asgi import CompressionMiddleware, Fragment, fragments_body
+
+    if encoding == "br" and hide_optional_dependencies:
+        pytest.skip("brotli package unavailable")
+
+    header = Fragment(b"<html><body><nav>" + b"link " * 400 + b"</nav>")
+    footer = Fragment(b"<footer>" + b"legal " * 400 + b"</footer></body></html>")
+    parts = [header, b"<main>" + os.urandom(64).hex().encode() * 8 + b"</main>"]
+    if ends_on_fragment:
+        parts.append(footer)
+    body_event = fragments_body(parts)
+    TEST_BODY = body_event["body"]
+
+    start, body = run_asgi(
+        CompressionMiddleware,
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/html"),
+                    (b"content-length", str(len(TEST_BODY)).encode()),
+                ],
+            },
+            body_event,
+        ],
+        headers=[(b"accept-encoding", encoding.encode())],
+    )
+
+    assert (b"content-encoding", encoding.encode()) in start["headers"]
+    assert "compress_asgi.fragments" not in body
+    if encoding == "gzip":
+        assert gzip.decompress(body["body"]) == TEST_BODY
+        # the static parts are copied as deflated
+        assert header.deflated in body["body"]
+    elif encoding == "deflate":
+        assert zlib.decompress(body["body"]) == TEST_BODY
+        assert header.deflated in body["body"]
+    else:
+        import brotli
+
+        assert brotli.decompress(body["body"]) == TEST_BODY
+
+
+@pytest.mark.parametrize(
+    ("content_type", "more_body"),
+    ((b"image/png", False), (b"text/plain", True)),
+)
+def test_fragments_key_not_forwarded(content_type: bytes, more_body: bool, run_asgi):
+    from compress_asgi import CompressionMiddleware, Fragment, fragments_body
+
+    body_event = fragments_body([Fragment(b"static " * 400), b"dynamic"])
+    body_event["more_body"] = more_body
+    events = [
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", content_type)],
+        },
+        body_event,
+    ]
+    if more_body:
+        events.append({"type": "http.response.body", "body": b""})
+
+    sent = run_asgi(CompressionMiddleware, events)
+
+    # passed through or streamed, the fragments never reach the server
+    assert all("compress_asgi.fragments" not in event for event in sent)
+
+
+SSE_OPTIONS = {"streaming_mediatype": ["text/event-stream"]}
+
+
+@pytest.mark.parametrize(
+    ("content_type", "content_length", "options", "released", "encoding"),
+    (
+        (b"text/event-stream", None, SSE_OPTIONS, True, b"gzip"),
+        (b"text/plain", 100000, {"stream_slice_size": 4096}, True, b"gzip"),
+        (b"image/png", None, {}, True, None),
+        (b"text/plain", 100, {}, True, None),
+        (b"text/plain", None, {}, False, b"gzip"),
+        (b"text/plain", 100000, {}, False, b"gzip"),
+        (
+            b"text/event-stream",
+            None,
+            {**SSE_OPTIONS, "probe_size": 1024},
+            False,
+            b"gzip",
+        ),
+    ),
+)
+def test_start_released_before_body(
+    content_type, content_length, options, released, encoding
+):
+    import asyncio
+    import zlib
+
+    from compress_asgi import CompressionMiddleware
+
+    TEST_BODY = b"data: 1\n\n" * 2000
+    headers = [(b"content-type", content_type)]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+
+    sent = []
+    sent_before_body = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        sent_before_body.extend(sent)
+        await send({"type": "http.response.body", "body": TEST_BODY, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(event):
+        sent.append(event)
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app, **options)(scope, None, send))
+
+    assert bool(sent_before_body) == released
+    start, *bodies = sent
+    assert dict(start["headers"]).get(b"content-encoding") == encoding
+    body = b"".join(event["body"] for event in bodies)
+    if encoding:
+        assert b"content-length" not in dict(start["headers"])
+        body = zlib.decompress(body, 31)
+    assert body == TEST_BODY
+
+
+@pytest.mark.parametrize("encoding", ("gzip", "deflate", "br", "zstd"))
+@pytest.mark.parametrize(
+    "chunk_sizes",
+    ((1000, 1000, 1000), (1000, 5000, 30000, 0), (2000, 2096, 10000), (50000,)),
+)
+def test_first_flight(encoding, chunk_sizes, hide_optional_dependencies):
+    import gzip
+    import zlib
+
+    from compress_asgi.compressors import get_encoder
+
+    if encoding in ("br", "zstd") and hide_optional_dependencies:
+        pytest.skip("encoder package unavailable")
+
+    def decompressor():
+        if encoding == "br":
+            import brotli
+
+            return brotli.Decompressor().process
+        if encoding == "zstd":
+            import zstandard
+
+            # reads concatenated frames, as HTTP clients do
+            return (
+                zstandard.ZstdDecompressor()
+                .decompressobj(read_across_frames=True)
+                .decompress
+            )
+        return zlib.decompressobj(31 if encoding == "gzip" else 15).decompress
+
+    FLIGHT = 4096
+    TEST_BODY = b"".join(b"<link rel=preload href=/%d.js>" % i for i in range(3000))
+    chunks, offset = [], 0
+    for size in chunk_sizes:
+        chunks.append(TEST_BODY[offset : offset + size])
+        offset += size
+    TEST_BODY = b"".join(chunks)
+
+    engine = get_encoder(encoding)("text/html", "best")
+    engine.first_flight(FLIGHT, "fastest")
+    outputs = [
+        engine.compress(chunk, index == len(chunks) - 1)
+        for index, chunk in enumerate(chunks)
+    ]
+
+    # every chunk of the first flight is decodable as soon as it is sent
+    decompress = decompressor()
+    received = b""
+    sent = 0
+    for chunk, output in zip(chunks, outputs):
+        received += decompress(output)
+        sent += len(chunk)
+        if sent <= FLIGHT:
+            assert received == TEST_BODY[:sent]
+
+    assert received == TEST_BODY
+    assert engine.content_length == sum(map(len, outputs))
+    if encoding == "gzip":
+        assert gzip.decompress(b"".join(outputs)) == TEST_BODY
+
+
+@pytest.mark.parametrize("size", (1024, 0))
+def test_first_flight_option(size: int, run_asgi):
+    import zlib
+
+    from compress_asgi import CompressionMiddleware
+
+    TEST_BODY = b"<head>" + b"<link rel=preload href=/app.js>" * 200 + b"</head>"
+
+    start, *bodies = run_asgi(
+        lambda app: CompressionMiddleware(app, first_flight=(size, "fastest")),
+        [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/html")],
+            },
+            {"type": "http.response.body", "body": TEST_BODY[:512], "more_body": True},
+            {"type": "http.response.body", "body": TEST_BODY[512:]},
+        ],
+    )
+
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    decompressobj = zlib.decompressobj(31)
+    first = decompressobj.decompress(bodies[0]["body"])
+    # a first flight of 0 bytes is disabled, so nothing is flushed early
+    assert (first == TEST_BODY[:512]) == (size > 0)
+    assert first + decompressobj.decompress(bodies[1]["body"]) == TEST_BODY
+
+
+def run_disconnecting_app(limiter, fail_send_after=None):
+    import asyncio
+
+    from compress_asgi import CompressionMiddleware
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    sent = []
+    seen = {}
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(event):
+        if fail_send_after is not None and len(sent) >= fail_send_after:
+            raise OSError("connection reset")
+        sent.append(event)
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        for index in range(5):
+            if index == 2 and fail_send_after is None:
+                assert (await receive())["type"] == "http.disconnect"
+            try:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": b"1" * 2000,
+                        "more_body": True,
+                    }
+                )
+            except OSError:
+                seen["send_errors"] = seen.get("send_errors", 0) + 1
+        await send({"type": "http.response.body", "body": b""})
+        seen["streams"] = limiter.streams
+
+    asyncio.run(CompressionMiddleware(app, limiter=limiter)(scope, receive, send))
+    return sent, seen
+
+
+@pytest.mark.parametrize(
+    ("fail_send_after", "sent_bodies", "send_errors"), ((None, 2, 0), (2, 1, 1))
+)
+def test_disconnect_stops_compression(fail_send_after, sent_bodies, send_errors):
+    from compress_asgi import CompressionLimiter
+
+    limiter = CompressionLimiter()
+    sent, seen = run_disconnecting_app(limiter, fail_send_after)
+
+    # nothing is sent or compressed after the disconnect, and the slot is free
+    assert [event["type"] for event in sent] == [
+        "http.response.start",
+        *["http.response.body"] * sent_bodies,
+    ]
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    assert seen == {"streams": 0, **({"send_errors": 1} if send_errors else {})}
+    assert limiter.compressed == 1
+
+
+def test_send_errors_other_than_disconnects_propagate():
+    import asyncio
+
+    from compress_asgi import CompressionMiddleware
+
+    sent = []
+    failures = [RuntimeError("bug in the server")]
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(event):
+        if event["type"] == "http.response.body" and failures:
+            raise failures.pop()
+        sent.append(event)
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        with pytest.raises(RuntimeError):
+            await send(
+                {"type": "http.response.body", "body": b"1" * 2000, "more_body": True}
+            )
+        await send({"type": "http.response.body", "body": b"1" * 2000})
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+
+    # not taken for a disconnect: the response carries on
+    assert [event["type"] for event in sent] == [
+        "http.response.start",
+        "http.response.body",
+    ]
+
+
+def test_disconnect_before_response_start():
+    import asyncio
+
+    from compress_asgi import CompressionMiddleware
+
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(event):
+        sent.append(event)
+
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"1" * 2000})
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+
+    assert sent == []
+
+
+def test_disconnect_drops_held_start():
+    import asyncio
+
+    from compress_asgi import CompressionMiddleware
+
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(event):
+        sent.append(event)
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-length", b"10")],
+            }
+        )
+        await receive()
+        await send({"type": "http.response.body", "body": b"1" * 10})
+
+    scope = {"type": "http", "path": "/", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app, server_timing=True)(scope, receive, send))
+
+    assert sent == []
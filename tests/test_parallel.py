@@ -0,0 +1,98 @@
+import asyncio
+import gzip
+import os
+import zlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.testclient import TestClient
+
+
+@pytest.mark.parametrize("length", (0, 1, 1000, 65521 * 3 + 7))
+def test_checksum_combine(length: int):
+    from compress_asgi.deflate_tools import adler32_combine, crc32_combine
+
+    first, second = os.urandom(1234), os.urandom(length)
+
+    assert crc32_combine(zlib.crc32(first), zlib.crc32(second), length) == zlib.crc32(
+        first + second
+    )
+    assert adler32_combine(
+        zlib.adler32(first), zlib.adler32(second), length
+    ) == zlib.adler32(first + second)
+
+
+@pytest.mark.parametrize("encoding", ("gzip", "deflate"))
+@pytest.mark.parametrize("block_size", (1000, 65536, 1 << 20))
+def test_parallel_stream_is_valid(encoding: str, block_size: int):
+    from compress_asgi import ParallelCompressor
+    from compress_asgi.compressors import DeflateEncoder, GzipEncoder
+
+    TEST_BODY = b"".join(b"%d lorem ipsum dolor " % i for i in range(20000))
+    engine = (GzipEncoder if encoding == "gzip" else DeflateEncoder)("text/plain")
+
+    compressed = asyncio.run(
+        ParallelCompressor(threshold=0, block_size=block_size).compress(
+            engine, TEST_BODY
+        )
+    )
+
+    decompress = gzip.decompress if encoding == "gzip" else zlib.decompress
+    assert decompress(compressed) == TEST_BODY
+    assert engine.content_length == len(compressed)
+    assert len(compressed) < len(TEST_BODY) / 3
+
+
+def test_parallel_zstd_is_valid(hide_optional_dependencies):
+    if hide_optional_dependencies:
+        pytest.skip("zstandard package unavailable")
+
+    import zstandard
+
+    from compress_asgi import ParallelCompressor
+    from compress_asgi.compressors import ZstdEncoder
+
+    TEST_BODY = b"".join(b"%d lorem ipsum dolor " % i for i in range(200000))
+    engine = ZstdEncoder("text/plain")
+
+    compressed = asyncio.run(
+        ParallelCompressor(threshold=0, zstd_threads=2).compress(engine, TEST_BODY)
+    )
+
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == (
+        TEST_BODY
+    )
+    assert engine.content_length == len(compressed)
+    assert len(compressed) < len(TEST_BODY) / 3
+
+
+@pytest.mark.parametrize(
+    ("encoding", "size"),
+    (("gzip", 300000), ("deflate", 300000), ("zstd", 300000), ("gzip", 2000)),
+)
+def test_parallel_responses(encoding: str, size: int, hide_optional_dependencies):
+    from compress_asgi import CompressionMiddleware, ParallelCompressor
+
+    if encoding == "zstd" and hide_optional_dependencies:
+        pytest.skip("zstandard package unavailable")
+
+    TEST_RESPONSE = b"".join(b"%d lorem ipsum " % i for i in range(size // 10))
+    TEST_PATH = "/"
+
+    app = Starlette()
+
+    app.add_middleware(
+        CompressionMiddleware,
+        parallel=ParallelCompressor(threshold=100000, block_size=32768),
+    )
+    app.add_route(
+        TEST_PATH, lambda request: Response(TEST_RESPONSE, media_type="text/plain")
+    )
+
+    with TestClient(app) as client:
+        response = client.get(TEST_PATH, headers={"accept-encoding": encoding})
+
+    assert response.content == TEST_RESPONSE
+    assert response.headers["content-encoding"] == encoding
+    assert int(response.headers["content-length"]) < len(TEST_RESPONSE)
@@ -0,0 +1,146 @@
+import base64
+import json
+
+import pytest
+
+TEST_BODY = b"Customer 4711 ordered 3 items\n" * 200
+
+
+@pytest.fixture
+def run_app(run_asgi):
+    def run(
+        middleware_factory,
+        chunks,
+        content_type=b"text/plain",
+        trailers=(),
+        path="/",
+        accept_encoding=b"gzip, br",
+    ):
+        response = [
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", content_type)],
+            },
+            *(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": index < len(chunks) - 1,
+                }
+                for index, chunk in enumerate(chunks)
+            ),
+            *trailers,
+        ]
+        return run_asgi(
+            middleware_factory,
+            response,
+            headers=[(b"accept-encoding", accept_encoding)],
+            path=path,
+        )
+
+    return run
+
+
+def read_records(path):
+    with open(path) as records:
+        return [json.loads(line) for line in records]
+
+
+@pytest.mark.parametrize("body", ("none", "hash", "redacted"))
+def test_recorder_writes_response_shape(tmp_path, body: str, run_app):
+    from compress_asgi import CompressionMiddleware, TrafficRecorder
+
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path, sample_rate=1, body=body)
+    chunks = [TEST_BODY[:1000], TEST_BODY[1000:], b""]
+
+    sent = run_app(lambda app: CompressionMiddleware(app, recorder=recorder), chunks)
+    run_app(
+        lambda app: CompressionMiddleware(app, recorder=recorder),
+        [b"\x89PNG" * 100],
+        content_type=b"image/png",
+    )
+    recorder.close()
+
+    streamed, image = read_records(path)
+    assert streamed["path"] == "/"
+    assert streamed["status"] == 200
+    assert streamed["content_type"] == "text/plain"
+    assert streamed["content_length"] is None
+    assert streamed["accept_encoding"] == "gzip, br"
+    assert streamed["encoding"] in ("gzip", "br")
+    assert streamed["chunks"] == [1000, len(TEST_BODY) - 1000, 0]
+    assert streamed["sent"] == [len(event["body"]) for event in sent[1:]]
+    assert 0 < streamed["ratio"] < 0.2
+    assert image["encoding"] == "identity"
+
+    if body == "hash":
+        assert len(streamed["digest"]) == 32
+    else:
+        assert "digest" not in streamed
+
+    if body == "redacted":
+        redacted = base64.b64decode(streamed["body"])
+        assert len(redacted) == len(TEST_BODY)
+        assert b"Customer" not in redacted and b"4711" not in redacted
+        # punctuation and whitespace survive, and so does the repetition
+        assert redacted.count(b"\n") == 200
+        assert redacted == redacted[:30] * 200
+    else:
+        assert "body" not in streamed
+
+
+def test_recorder_samples_and_limits_bodies(tmp_path, run_app):
+    from compress_asgi import CompressionMiddleware, TrafficRecorder
+
+    path = str(tmp_path / "traffic.jsonl")
+    skipping = TrafficRecorder(path, sample_rate=0)
+    recorder = TrafficRecorder(path, sample_rate=1, body="redacted", max_body_size=100)
+
+    run_app(lambda app: CompressionMiddleware(app, recorder=skipping), [TEST_BODY])
+    run_app(lambda app: CompressionMiddleware(app, recorder=recorder), [b""])
+    run_app(
+        lambda app: CompressionMiddleware(app, recorder=recorder),
+        [TEST_BODY * 20, TEST_BODY * 20],
+        trailers=[{"type": "http.response.trailers", "headers": []}],
+    )
+    skipping.close()
+    recorder.close()
+
+    empty, large = read_records(path)
+    assert empty["ratio"] == 1.0
+    assert empty["body"] == ""
+    assert "body" not in large
+    assert large["chunks"] == [len(TEST_BODY) * 20] * 2
+
+    with pytest.raises(ValueError):
+        TrafficRecorder(path, body="plain")
+
+
+@pytest.mark.parametrize(
+    ("path", "accept_encoding"), (("/raw/file", b"gzip"), ("/", b"identity"))
+)
+def test_recorder_samples_bypassed_responses(
+    tmp_path, path: str, accept_encoding, run_app
+):
+    from compress_asgi import CompressionMiddleware, TrafficRecorder
+
+    records_path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(records_path, sample_rate=1)
+    chunks = [TEST_BODY, b""]
+
+    run_app(
+        lambda app: CompressionMiddleware(
+            app, recorder=recorder, path_overrides={"/raw": False}
+        ),
+        chunks,
+        path=path,
+        accept_encoding=accept_encoding,
+    )
+    recorder.close()
+
+    (record,) = read_records(records_path)
+    assert record["path"] == path
+    assert record["encoding"] == "identity"
+    assert record["chunks"] == record["sent"] == [len(TEST_BODY), 0]
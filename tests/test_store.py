@@ -0,0 +1,328 @@
+import asyncio
+import gzip
+
+import pytest
+
+
+@pytest.fixture
+def run_app(run_asgi):
+    def run(
+        middleware_factory,
+        body: bytes,
+        headers=(),
+        request_headers=(),
+        query_string=b"",
+    ):
+        response = (
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", str(len(body)).encode()),
+                    *headers,
+                ],
+            },
+            {"type": "http.response.body", "body": body},
+        )
+        return run_asgi(
+            middleware_factory,
+            response,
+            headers=[(b"accept-encoding", b"gzip"), *request_headers],
+            query_string=query_string,
+        )
+
+    return run
+
+
+def test_mmap_store_roundtrip(tmp_path):
+    from compress_asgi import MmapStore
+
+    store = MmapStore(str(tmp_path / "store"), size=1 << 16, index_slots=64)
+
+    async def run():
+        assert await store.get(b"missing") is None
+        await store.put(b"key", b"value")
+        await store.put(b"large", b"1" * (store.max_body_size + 1))
+        return await store.get(b"key"), await store.get(b"large")
+
+    assert asyncio.run(run()) == (b"value", None)
+    store.close()
+
+
+def test_mmap_store_is_shared_between_instances(tmp_path):
+    from compress_asgi import MmapStore
+
+    path = str(tmp_path / "store")
+    writer = MmapStore(path, size=1 << 16, index_slots=64)
+    asyncio.run(writer.put(b"key", b"value"))
+
+    reader = MmapStore(path, size=1 << 16, index_slots=64)
+    assert asyncio.run(reader.get(b"key")) == b"value"
+
+    with pytest.raises(ValueError):
+        MmapStore(path, size=1 << 17, index_slots=64)
+    with pytest.raises(ValueError):
+        MmapStore(path, size=1 << 16, index_slots=32)
+    with pytest.raises(ValueError):
+        MmapStore(str(tmp_path / "tiny"), size=64, index_slots=64)
+
+    writer.close()
+    reader.close()
+
+
+def test_mmap_store_evicts_oldest(tmp_path):
+    from compress_asgi import MmapStore
+
+    store = MmapStore(str(tmp_path / "store"), size=1 << 14, index_slots=256)
+    values = [bytes([index]) * 1000 for index in range(40)]
+
+    async def run():
+        for index, value in enumerate(values):
+            await store.put(b"key%d" % index, value)
+        return [await store.get(b"key%d" % index) for index in range(len(values))]
+
+    found = asyncio.run(run())
+    assert found[0] is None
+    assert found[-1] == values[-1]
+    assert all(value in (None, values[index]) for index, value in enumerate(found))
+    store.close()
+
+
+def test_mmap_store_drops_torn_bodies(tmp_path):
+    from compress_asgi import MmapStore
+
+    store = MmapStore(str(tmp_path / "store"), size=1 << 16, index_slots=64)
+    asyncio.run(store.put(b"key", b"value"))
+    store.map[store.data_offset] ^= 0xFF
+
+    assert asyncio.run(store.get(b"key")) is None
+    store.close()
+
+
+def test_redis_store():
+    from compress_asgi import RedisStore
+
+    class FakeRedis:
+        def __init__(self):
+            self.data = {}
+
+        async def get(self, key):
+            return self.data.get(key)
+
+        async def set(self, key, value, ex=None):
+            self.data[key] = value
+
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError
+
+        async def set(self, key, value, ex=None):
+            raise ConnectionError
+
+    client = FakeRedis()
+    store = RedisStore(client, max_body_size=10)
+
+    async def run(store):
+        await store.put(b"key", b"value")
+        await store.put(b"large", b"1" * 11)
+        return await store.get(b"key"), await store.get(b"large")
+
+    assert asyncio.run(run(store)) == (b"value", None)
+    assert list(client.data) == [b"compress_asgi:key"]
+    assert asyncio.run(run(RedisStore(BrokenRedis()))) == (None, None)
+
+
+def test_body_store_is_abstract():
+    from compress_asgi.store import BodyStore
+
+    with pytest.raises(TypeError):
+        BodyStore()
+
+
+def test_middleware_serves_hits_from_store(tmp_path, run_app):
+    from compress_asgi import CompressionMiddleware, MmapStore
+    from compress_asgi.store import BodyStore
+
+    TEST_BODY = b"1" * 2000
+
+    class CountingStore(MmapStore):
+        hits = 0
+
+        async def get(self, key):
+            value = await super().get(key)
+            self.hits += value is not None
+            return value
+
+    path = str(tmp_path / "store")
+    stores = [CountingStore(path), CountingStore(path)]
+    assert isinstance(stores[0], BodyStore)
+
+    # the second store stands in for a cold worker sharing the file
+    for store in stores:
+        start, body = run_app(
+            lambda app: CompressionMiddleware(app, store=store), TEST_BODY
+        )
+        assert (b"content-encoding", b"gzip") in start["headers"]
+        assert gzip.decompress(body["body"]) == TEST_BODY
+
+    assert [store.hits for store in stores] == [0, 1]
+
+    start, body = run_app(
+        lambda app: CompressionMiddleware(app, minimum_size=10_000, store=stores[0]),
+        TEST_BODY,
+    )
+    assert body["body"] == TEST_BODY
+
+    for store in stores:
+        store.close()
+
+
+@pytest.mark.parametrize("server_timing", (False, True))
+def test_disconnect_during_store_lookup(server_timing, run_asgi):
+    from compress_asgi import CompressionMiddleware
+    from compress_asgi.store import BodyStore
+
+    class SlowStore(BodyStore):
+        def __init__(self):
+            self.bodies = {}
+
+        async def get(self, key):
+            await asyncio.sleep(0)
+            return self.bodies.get(key)
+
+        async def put(self, key, value):
+            self.bodies[key] = value
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-length", b"2000"),
+                ],
+            }
+        )
+        # the client leaves while the body waits on the store
+        await asyncio.gather(
+            send({"type": "http.response.body", "body": b"1" * 2000}), receive()
+        )
+
+    store = SlowStore()
+    sent = run_asgi(
+        lambda app: CompressionMiddleware(
+            app, store=store, server_timing=server_timing
+        ),
+        app,
+        receive_type="http.disconnect",
+    )
+
+    # nothing is sent, and the dropped engine's output is not stored
+    assert sent == []
+    assert store.bodies == {}
+
+
+def test_store_keys_by_strong_etag(tmp_path, run_app):
+    from compress_asgi import CompressionMiddleware, MmapStore
+
+    store = MmapStore(str(tmp_path / "store"))
+    middleware = lambda app: CompressionMiddleware(app, store=store)  # noqa: E731
+
+    def fetch(body: bytes, etag: bytes) -> bytes:
+        _, sent = run_app(middleware, body, headers=[(b"etag", etag)])
+        return gzip.decompress(sent["body"])
+
+    assert fetch(b"1" * 2000, b'"v1"') == b"1" * 2000
+    # an unchanged strong ETag is trusted without hashing the body
+    assert fetch(b"2" * 2000, b'"v1"') == b"1" * 2000
+    assert fetch(b"3" * 2000, b'W/"v1"') == b"3" * 2000
+    store.close()
+
+
+def test_strong_etag_is_scoped_to_the_resource(tmp_path, run_app):
+    from compress_asgi import CompressionMiddleware, MmapStore
+
+    store = MmapStore(str(tmp_path / "store"))
+    middleware = lambda app: CompressionMiddleware(app, store=store)  # noqa: E731
+
+    def fetch(body: bytes, query_string: bytes, host: bytes) -> bytes:
+        _, sent = run_app(
+            middleware,
+            body,
+            headers=[(b"etag", b'"1700000000-2000"')],
+            request_headers=[(b"host", host)],
+            query_string=query_string,
+        )
+        return gzip.decompress(sent["body"])
+
+    # files of one size and mtime share an ETag, but not a stored body
+    assert fetch(b"a" * 2000, b"file=a", b"example.com") == b"a" * 2000
+    assert fetch(b"b" * 2000, b"file=b", b"example.com") == b"b" * 2000
+    assert fetch(b"c" * 2000, b"file=a", b"example.org") == b"c" * 2000
+    assert fetch(b"d" * 2000, b"file=a", b"example.com") == b"a" * 2000
+    store.close()
+
+
+@pytest.mark.parametrize(
+    ("etag", "request_headers", "expected_range"),
+    (
+        (b'"v1"', [(b"range", b"bytes=0-9")], (0, 10)),
+        (b'"v1"', [(b"range", b"bytes=-5")], (-5, None)),
+        (b'"v1"', [(b"range", b"bytes=10-")], (10, None)),
+        (
+            b'"v1"',
+            [(b"range", b"bytes=10-99999"), (b"if-range", b'"v1-gzip"')],
+            (10, None),
+        ),
+        (b"v1", [(b"range", b"bytes=0-9"), (b"if-range", b"v1-gzip")], (0, 10)),
+        (b'"v1"', [(b"range", b"bytes=0-9"), (b"if-range", b'"v1"')], None),
+        (b'"v1"', [(b"range", b"bytes=0-9"), (b"if-range", b'"v0-gzip"')], None),
+        (b'W/"v1"', [(b"range", b"bytes=0-9")], None),
+        (b'"v1"', [(b"range", b"bytes=0-1,4-5")], None),
+        (b'"v1"', [(b"range", b"items=0-9")], None),
+        (b'"v1"', [(b"range", b"bytes=a-b")], None),
+        (b'"v1"', [(b"range", b"bytes=9-0")], None),
+        (b'"v1"', [], None),
+    ),
+)
+def test_store_serves_byte_ranges(
+    tmp_path, etag, request_headers, expected_range, run_app
+):
+    from compress_asgi import CompressionMiddleware, MmapStore
+
+    TEST_BODY = b"".join(b"%d lorem ipsum " % i for i in range(500))
+
+    store = MmapStore(str(tmp_path / "store"))
+    middleware = lambda app: CompressionMiddleware(app, store=store)  # noqa: E731
+    full_start, full = run_app(middleware, TEST_BODY, headers=[(b"etag", etag)])
+    start, body = run_app(
+        middleware,
+        TEST_BODY,
+        headers=[(b"etag", etag)],
+        request_headers=request_headers,
+    )
+    store.close()
+
+    compressed = full["body"]
+    headers = dict(start["headers"])
+    # byte offsets are only valid within one coding, so the ETag names it
+    coded_etag = {b'"v1"': b'"v1-gzip"', b"v1": b"v1-gzip"}.get(etag, etag)
+    assert dict(full_start["headers"])[b"etag"] == coded_etag
+    assert headers[b"etag"] == coded_etag
+    if expected_range is None:
+        assert (start["status"], body["body"]) == (200, compressed)
+        assert b"content-range" not in headers
+        return
+
+    # the range applies to the stored, compressed representation
+    part = compressed[slice(*expected_range)]
+    first = slice(*expected_range).indices(len(compressed))[0]
+    assert (start["status"], body["body"]) == (206, part)
+    assert headers[b"content-range"] == b"bytes %d-%d/%d" % (
+        first,
+        first + len(part) - 1,
+        len(compressed),
+    )
+    assert headers[b"content-length"] == str(len(part)).encode()
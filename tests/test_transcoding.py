@@ -0,0 +1,272 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+TEST_RESPONSE = b"".join(b"line %d of the upstream response\n" % i for i in range(4000))
+
+
+def encode(encoding: str, data: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data)
+    if encoding == "deflate":
+        return zlib.compress(data)
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(data)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decode(encoding: str, data: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress(data)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+@pytest.fixture
+def run_app(run_asgi):
+    def run(
+        chunks,
+        content_encoding: bytes,
+        accept_encoding: bytes,
+        status=200,
+        transcode=True,
+    ):
+        from compress_asgi import CompressionMiddleware
+
+        response = [
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-encoding", content_encoding),
+                ],
+            },
+            *(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": index < len(chunks) - 1,
+                }
+                for index, chunk in enumerate(chunks)
+            ),
+        ]
+        sent = run_asgi(
+            lambda app: CompressionMiddleware(app, transcode=transcode),
+            response,
+            headers=[(b"accept-encoding", accept_encoding)],
+        )
+
+        headers = dict(sent[0]["headers"])
+        return headers, b"".join(event.get("body", b"") for event in sent[1:])
+
+    return run
+
+
+def split(data: bytes, parts: int = 4):
+    size = len(data) // parts + 1
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("encoding", ("br", "zstd", "identity"))
+def test_gzip_upstream_is_transcoded(encoding, hide_optional_dependencies, run_app):
+    if encoding != "identity" and hide_optional_dependencies:
+        pytest.skip("brotli and zstandard packages unavailable")
+
+    headers, body = run_app(
+        split(gzip.compress(TEST_RESPONSE)), b"gzip", encoding.encode()
+    )
+
+    assert headers.get(b"content-encoding", b"identity") == encoding.encode()
+    assert b"content-length" not in headers
+    assert headers[b"vary"] == b"accept-encoding"
+    assert decode(encoding, body) == TEST_RESPONSE
+
+
+@pytest.mark.parametrize("encoding", ("deflate", "br", "zstd"))
+def test_other_upstream_codings_are_transcoded(
+    encoding, hide_optional_dependencies, run_app
+):
+    if encoding != "deflate" and hide_optional_dependencies:
+        pytest.skip("brotli and zstandard packages unavailable")
+
+    headers, body = run_app(
+        split(encode(encoding, TEST_RESPONSE)), encoding.encode(), b"gzip"
+    )
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body) == TEST_RESPONSE
+
+
+def test_multi_member_gzip_upstream(run_app):
+    large_member = gzip.compress(b"0" * 200000)
+    upstream = large_member + gzip.compress(TEST_RESPONSE)
+
+    # the first chunk only holds part of the gzip header and decodes to nothing
+    chunks = [upstream[:5], *split(upstream[5:], 7)]
+    headers, body = run_app(chunks, b"x-gzip", b"identity")
+
+    assert b"content-encoding" not in headers
+    assert body == b"0" * 200000 + TEST_RESPONSE
+
+
+def zeros_upstream(encoding: str, size: int) -> bytes:
+    """`size` zero bytes in `encoding`, compressed a MiB at a time."""
+    chunk = bytes(1 << 20)
+    if encoding == "gzip":
+        compressobj = zlib.compressobj(6, zlib.DEFLATED, 31)
+        return (
+            b"".join(compressobj.compress(chunk) for _ in range(size >> 20))
+            + compressobj.flush()
+        )
+    if encoding == "br":
+        import brotli
+
+        compressor = brotli.Compressor(quality=1)
+        return (
+            b"".join(compressor.process(chunk) for _ in range(size >> 20))
+            + compressor.finish()
+        )
+
+    import zstandard
+
+    compressobj = zstandard.ZstdCompressor(level=1).compressobj()
+    return (
+        b"".join(compressobj.compress(chunk) for _ in range(size >> 20))
+        + compressobj.flush()
+    )
+
+
+@pytest.mark.parametrize(
+    ("content_encoding", "accept_encoding", "size"),
+    (
+        ("gzip", b"identity", 200 << 20),
+        ("br", b"identity", 64 << 20),
+        ("zstd", b"identity", 64 << 20),
+        ("br", b"gzip", 16 << 20),
+    ),
+)
+def test_inflated_bodies_are_sent_in_slices(
+    content_encoding, accept_encoding, size, hide_optional_dependencies
+):
+    from compress_asgi import CompressionMiddleware
+
+    if content_encoding != "gzip" and hide_optional_dependencies:
+        pytest.skip("brotli and zstandard packages unavailable")
+
+    upstream = zeros_upstream(content_encoding, size)
+    sizes = []
+    decompressobj = zlib.decompressobj(31)
+    decoded_size = 0
+
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain"),
+                    (b"content-encoding", content_encoding.encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": upstream})
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(event):
+        nonlocal decoded_size
+        if event["type"] == "http.response.body":
+            sizes.append(len(event["body"]))
+            if accept_encoding == b"gzip":
+                decoded_size += len(decompressobj.decompress(event["body"]))
+            else:
+                decoded_size += len(event["body"])
+
+    scope = {
+        "type": "http",
+        "path": "/",
+        "headers": [(b"accept-encoding", accept_encoding)],
+    }
+    asyncio.run(CompressionMiddleware(app, transcode=True)(scope, receive, send))
+
+    # one upstream chunk inflating to many MiB still leaves in bounded slices
+    assert decoded_size == size
+    assert len(sizes) > 1
+    assert max(sizes) <= 65536
+
+
+def test_unbounded_brotli_decoder(hide_optional_dependencies):
+    if hide_optional_dependencies:
+        pytest.skip("brotli package unavailable")
+
+    import brotli
+
+    from compress_asgi.transcoding import BrotliDecoder
+
+    # brotli before 1.1 returns everything a chunk decodes to at once
+    decoder = BrotliDecoder()
+    decoder.bounded = False
+
+    assert list(decoder.decode(brotli.compress(TEST_RESPONSE))) == [TEST_RESPONSE]
+
+
+@pytest.mark.parametrize(
+    ("content_encoding", "accept_encoding", "status"),
+    (
+        (b"gzip", b"gzip, br", 200),
+        (b"GZIP", b"gzip;q=0.5", 200),
+        (b"compress", b"gzip", 200),
+        (b"gzip, br", b"zstd", 200),
+        (b"gzip", b"br", 206),
+    ),
+)
+def test_upstream_coding_passes_through(
+    content_encoding, accept_encoding, status, run_app
+):
+    upstream = gzip.compress(TEST_RESPONSE)
+
+    headers, body = run_app(
+        split(upstream), content_encoding, accept_encoding, status=status
+    )
+
+    assert headers[b"content-encoding"] == content_encoding
+    assert body == upstream
+
+
+@pytest.mark.parametrize("parts", (1, 4))
+def test_upstream_coding_passes_through_without_transcoding(parts, run_app):
+    upstream = gzip.compress(TEST_RESPONSE)
+
+    headers, body = run_app(
+        split(upstream, parts), b"gzip", b"gzip, br", transcode=False
+    )
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert body == upstream
+
+
+def test_unavailable_decoder_passes_through(hide_optional_dependencies, run_app):
+    if not hide_optional_dependencies:
+        pytest.skip("brotli package installed")
+
+    headers, body = run_app([b"brotli bytes"], b"br", b"gzip")
+
+    assert headers[b"content-encoding"] == b"br"
+    assert body == b"brotli bytes"
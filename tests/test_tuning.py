@@ -0,0 +1,126 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    (tmp_path / "application" / "json").mkdir(parents=True)
+    (tmp_path / "text" / "html").mkdir(parents=True)
+    (tmp_path / "application" / "json" / "a.json").write_bytes(
+        json.dumps(
+            [{"id": index, "name": f"item {index}"} for index in range(200)]
+        ).encode()
+    )
+    (tmp_path / "text" / "html" / "index.html").write_bytes(
+        b"<p>" + b"<a href=/x>link</a> " * 300 + b"</p>"
+    )
+    (tmp_path / "text" / "html" / "random.html").write_bytes(os.urandom(2000))
+    (tmp_path / "text" / "html" / "assets").mkdir()
+    (tmp_path / "README").write_text("not a sample")
+    return str(tmp_path)
+
+
+def test_tune_within_budget(corpus):
+    from compress_asgi.compressors import get_encoder
+    from compress_asgi.tuning import tune
+
+    with ThreadPoolExecutor(2) as executor:
+        policy = tune(corpus, 1e9, repeat=1, executor=executor)
+
+    assert set(policy["tiers"]) == {"application/json", "text/html"}
+    for mimetype, tiers in policy["tiers"].items():
+        measurements = policy["measurements"][mimetype]
+        ratios = []
+        for largest, encoding_name, level in tiers:
+            assert largest is None
+            # with no budget to speak of, every encoding gets its best ratio
+            ratio = min(option["ratio"] for option in measurements[encoding_name])
+            assert ratio in [
+                option["ratio"]
+                for option in measurements[encoding_name]
+                if option["level"] == level
+            ]
+            ratios.append(ratio)
+            assert level in get_encoder(encoding_name).levels
+        assert ratios == sorted(ratios)
+
+
+def test_tune_over_budget_picks_cheapest(corpus):
+    from compress_asgi.tuning import tune
+
+    with ThreadPoolExecutor(1) as executor:
+        policy = tune(corpus, 0, repeat=1, executor=executor)
+
+    for mimetype, tiers in policy["tiers"].items():
+        for _, encoding_name, level in tiers:
+            options = policy["measurements"][mimetype][encoding_name]
+            cheapest = min(options, key=lambda option: option["us_per_kb"])
+            assert level == cheapest["level"]
+
+
+def test_tune_puts_encodings_within_budget_first(corpus, monkeypatch):
+    from compress_asgi import tuning
+
+    def measure(mimetype, encoding_name, level, repeat):
+        # gzip fits a budget of 20 us/KiB, other encodings compress better
+        # but only fit at 100 us/KiB and above
+        cost = level if encoding_name == "gzip" else 100 + level
+        ratio = (0.5 if encoding_name == "gzip" else 0.1) - level / 1000
+        return (mimetype, encoding_name, level, 1024, int(ratio * 1024), cost / 1e6)
+
+    monkeypatch.setattr(tuning, "measure", measure)
+    with ThreadPoolExecutor(1) as executor:
+        policy = tuning.tune(corpus, 20, repeat=1, executor=executor)
+
+    for mimetype, tiers in policy["tiers"].items():
+        measurements = policy["measurements"][mimetype]
+        assert tiers[0] == (None, "gzip", 9)
+        fallback_costs = []
+        for _, encoding_name, level in tiers[1:]:
+            options = measurements[encoding_name]
+            cheapest = min(options, key=lambda option: option["us_per_kb"])
+            assert level == cheapest["level"]
+            fallback_costs.append(cheapest["us_per_kb"])
+        assert fallback_costs == sorted(fallback_costs)
+
+
+@pytest.mark.parametrize(
+    "budget",
+    (["--min-mb-per-s", "0"], ["--min-mb-per-s", "-1"], ["--max-us-per-kb", "-1"]),
+)
+def test_cli_rejects_unusable_budgets(corpus, capsys, budget):
+    from compress_asgi.tuning import main
+
+    with pytest.raises(SystemExit):
+        main([corpus, *budget])
+    assert budget[0] in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    ("budget", "max_us_per_kb"),
+    ((["--min-mb-per-s", "1e-9"], 1e6 / (1e-9 * 1024)), (["--max-us-per-kb", "0"], 0)),
+)
+def test_cli_writes_policy_for_middleware(
+    corpus, tmp_path, capsys, budget, max_us_per_kb
+):
+    from compress_asgi import CompressionMiddleware
+    from compress_asgi.tuning import main
+
+    output = str(tmp_path / "policy.json")
+    main([corpus, *budget, "--repeat", "1", "-o", output])
+
+    with open(output) as policy_file:
+        policy = json.load(policy_file)
+    assert policy["max_us_per_kb"] == pytest.approx(max_us_per_kb)
+    assert "application/json" in capsys.readouterr().out
+
+    middleware = CompressionMiddleware(
+        None, policy=output, tiers={"text/html": [(None, "gzip", 1)]}
+    )
+    assert middleware.tiers["text/html"] == ((None, "gzip", 1),)
+    assert middleware.tiers["application/json"] == tuple(
+        tuple(tier) for tier in policy["tiers"]["application/json"]
+    )